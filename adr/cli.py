@@ -8,12 +8,15 @@ import time
 import webbrowser
 from pathlib import Path
 
+import zstandard
+from cachy.stores import FileStore
 from loguru import logger
 
 from adr import config, sources
 from adr.formatter import all_formatters
 from adr.query import format_query
 from adr.recipe import run_recipe
+from adr.util.cache_stores import CompressedPickleDictSerializer, MemoryStore, sample_file_store
 
 here = Path(__file__).parent.resolve()
 
@@ -147,6 +150,31 @@ def get_parser():
     )
     configcmd.set_defaults(func=handle_config)
 
+    # cache subcommand
+    cachecmd = subparsers.add_parser("cache", help="Manage the cache.")
+    cachecmd.set_defaults(func=lambda remainder: cachecmd.print_help())
+    cache_subparsers = cachecmd.add_subparsers(title="cache subcommands")
+
+    train_dict = cache_subparsers.add_parser(
+        "train-dict",
+        help="Train a compression dictionary for the 'compressedpickle-dict' serializer.",
+    )
+    train_dict.add_argument(
+        "--samples",
+        dest="dict_samples",
+        type=int,
+        default=1000,
+        help="Maximum number of cache entries to train the dictionary on (default: 1000).",
+    )
+    train_dict.add_argument(
+        "--size",
+        dest="dict_size",
+        type=int,
+        default=112640,
+        help="Size of the dictionary in bytes (default: 112640).",
+    )
+    train_dict.set_defaults(func=handle_cache_train_dict)
+
     parser.set_default_subparser("recipe")
     return parser
 
@@ -170,6 +198,34 @@ def handle_config(remainder):
         subprocess.Popen([editor, config.path]).wait()
 
 
+def handle_cache_train_dict(remainder):
+    store = config.cache.store().get_store()
+    if isinstance(store, MemoryStore):
+        store = store.store
+
+    serializer = store._serializer
+    if not isinstance(serializer, CompressedPickleDictSerializer):
+        logger.error("the cache must use the 'compressedpickle-dict' serializer!")
+        return
+    if not isinstance(store, FileStore):
+        logger.error("training a dictionary is only supported for file based stores!")
+        return
+
+    samples = list(sample_file_store(store, config.dict_samples))
+    if not samples:
+        logger.error("the cache is empty, there is nothing to train a dictionary on!")
+        return
+
+    try:
+        dict_id = serializer.train(samples, config.dict_size)
+    except zstandard.ZstdError as e:
+        logger.error(f"failed to train dictionary: {e}")
+        return
+
+    return (f"Trained dictionary {dict_id} on {len(samples)} cache entries, "
+            f"saved to {serializer.path}")
+
+
 def handle_list(remainder):
     key = "queries" if config.subcommand == "query" else "recipes"
     lines = []
@@ -0,0 +1,81 @@
+def _select_names(select):
+    """Returns the names of the selected columns, or None if any of them is
+    unnamed (e.g `*`) or aggregated."""
+    names = []
+    for s in select:
+        if isinstance(s, dict) and s.get("aggregate", "none") != "none":
+            return None
+        if isinstance(s, str) and s != "*" and not s.endswith(".*"):
+            names.append(s)
+        elif isinstance(s, dict) and isinstance(s.get("name"), str):
+            names.append(s["name"])
+        elif isinstance(s, dict) and isinstance(s.get("value"), str) and len(s) == 1:
+            names.append(s["value"])
+        else:
+            return None
+    return names
+
+
+def compact_query(query):
+    """Rewrites a `list` query to the more compact `table` format.
+
+    In the `list` format the name of every column is repeated on every row,
+    whereas `table` lists them once in a header. The result of the rewritten
+    query can be turned back into the original format with `expand_result`.
+
+    Only queries selecting named columns without grouping are rewritten.
+
+    :param dict query: the query.
+    :return dict: the rewritten query, or None if it can't be rewritten.
+    """
+    if query.get("format", "list") != "list":
+        return None
+    if any(key in query for key in ("edges", "groupby")):
+        return None
+
+    select = query.get("select")
+    if select is None or _select_names(select if isinstance(select, list) else [select]) is None:
+        return None
+    return dict(query, format="table")
+
+
+def _set_path(row, name, value):
+    *parents, leaf = name.split(".")
+    for part in parents:
+        row = row.setdefault(part, {})
+    row[leaf] = value
+
+
+def expand_result(query, result):
+    """Turns the `table` result of a query rewritten by `compact_query` back
+    into the `list` format the query asked for.
+
+    Rows of a query selecting a single column (not in a list) are plain
+    values. Otherwise rows are objects, in which dotted names are nested
+    and null values left out, like ActiveData does.
+
+    :param dict query: the original query.
+    :param dict result: the result of the rewritten query.
+    :return dict: the result in the `list` format.
+    """
+    header = result.get("header")
+    if header is None:
+        return result
+
+    expanded = {k: v for k, v in result.items() if k != "header"}
+    rows = result.get("data") or []
+    if not isinstance(query.get("select"), list):
+        expanded["data"] = [row[0] for row in rows]
+    else:
+        data = []
+        for row in rows:
+            obj = {}
+            for name, value in zip(header, row):
+                if value is not None:
+                    _set_path(obj, name, value)
+            data.append(obj)
+        expanded["data"] = data
+
+    if isinstance(expanded.get("meta"), dict):
+        expanded["meta"] = dict(expanded["meta"], format="list")
+    return expanded
@@ -1,5 +1,6 @@
 import copy
 import os
+import threading
 from collections import Mapping
 from pathlib import Path
 
@@ -10,7 +11,9 @@ from tomlkit import parse
 
 import adr
 from adr.util.cache_stores import (
+    CompressedPickleDictSerializer,
     CompressedPickleSerializer,
+    MemoryStore,
     NullStore,
     RenewingFileStore,
     S3Store,
@@ -67,7 +70,27 @@ def flatten(d, prefix=""):
 
 
 class CustomCacheManager(CacheManager):
-    def __init__(self, cache_config):
+    _resolve_lock = threading.Lock()
+
+    def __init__(self, cache_config, stores=None):
+        """A CacheManager that shares its stores between threads.
+
+        cachy's CacheManager is thread local and resolves the store again on
+        every access, which loses any state kept in memory by the store
+        (and e.g fetches S3 credentials on every call). This subclass
+        resolves each store once and keeps it in `stores`. Pass the same
+        dict to share stores between threads: thread local objects run
+        `__init__` again in every thread, with the same arguments.
+
+        With `memory.max_size` set, each store is fronted by a `MemoryStore`.
+
+        Args:
+            cache_config (dict): The cache configuration.
+            stores (dict): Where to keep resolved stores.
+        """
+        self._shared_stores = {} if stores is None else stores
+        self._memory_config = cache_config.get("memory", {})
+
         super_config = {
             k: v
             for k, v in cache_config.items()
@@ -87,16 +110,76 @@ class CustomCacheManager(CacheManager):
         )
         self.extend("s3", S3Store)
 
-        self.register_serializer("compressedpickle", CompressedPickleSerializer())
+        compression = dict(cache_config.get("compression", {}))
+        dict_path = compression.pop("dict_path", None)
+        if dict_path is None:
+            # Keep dictionaries next to (but not in) the default file store.
+            default = super_config["stores"].get(cache_config.get("default"), {})
+            if default.get("path"):
+                dict_path = default["path"].rstrip("/\\") + "-dicts"
+
+        self.register_serializer("compressedpickle", CompressedPickleSerializer(**compression))
+        self.register_serializer(
+            "compressedpickle-dict", CompressedPickleDictSerializer(dict_path, **compression)
+        )
 
         # Now we can manually set the serializer we wanted.
         self._serializer = self._resolve_serializer(cache_config.get("serializer", "pickle"))
 
+    def store(self, name=None):
+        if name is None:
+            name = self.get_default_driver()
+
+        if name not in self._shared_stores:
+            with self._resolve_lock:
+                if name not in self._shared_stores:
+                    self._shared_stores[name] = self._resolve_with_memory(name)
+        return self._shared_stores[name]
+
+    def _resolve_with_memory(self, name):
+        """Resolve a store, putting the in-memory tier in front of it if enabled."""
+        repository = self._resolve(name)
+
+        max_size = self._memory_config.get("max_size", 0)
+        if not max_size or name == "null":
+            return repository
+
+        return self.repository(MemoryStore(
+            repository.get_store(),
+            max_size * 1024 * 1024,
+            self._memory_config.get("ttl", 0),
+        ))
+
 
 class Configuration(Mapping):
     DEFAULT_CONFIG_PATH = Path(user_config_dir("adr")) / "config.toml"
     DEFAULTS = {
-        "cache": {"retention": 1440},  # minutes
+        "activedata": {
+            "compact_format": False,
+            "endpoints": {},
+            "job_timeout": 300,  # seconds
+            "max_concurrency": 4,
+            "page_retries": 2,
+            "page_size": 0,  # rows
+            "poll_initial_delay": 0.5,  # seconds
+            "poll_max_delay": 10,  # seconds
+        },
+        "cache": {
+            "compression": {
+                "level": 10,
+                "min_size": 512,  # bytes
+                "threads": 0,
+            },
+            "legacy_keys": True,
+            "max_staleness": 0,  # minutes
+            "memory": {
+                "max_size": 0,  # megabytes
+                "ttl": 10,  # minutes
+            },
+            "retention": 1440,  # minutes
+            "shard": None,  # e.g "day"
+            "shard_retention": 43200,  # minutes
+        },
         "debug": False,
         "debug_url": "https://activedata.allizom.org/tools/query.html#query_id={}",
         "fmt": "table",
@@ -119,7 +202,7 @@ class Configuration(Mapping):
 
         self._config["sources"] = sorted(map(os.path.expanduser, set(self._config["sources"])))
 
-        self.cache = CustomCacheManager(self._config['cache'])
+        self.cache = CustomCacheManager(self._config['cache'], stores={})
         self.locked = True
 
     def __len__(self):
@@ -168,7 +251,9 @@ class Configuration(Mapping):
         self._config["sources"] = sorted(
             map(os.path.expanduser, set(self._config["sources"]))
         )
-        object.__setattr__(self, "cache", CustomCacheManager(self._config['cache']))
+        object.__setattr__(
+            self, "cache", CustomCacheManager(self._config['cache'], stores={})
+        )
 
     def dump(self):
         return "\n".join(flatten(self._config))
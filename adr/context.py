@@ -183,7 +183,7 @@ def extract_arguments(func, call, members=None):
 
     Args:
         func (function): function object to extract
-        call (str): name of child function being called inside func
+        call (str or tuple): name(s) of child function being called inside func
         members (list): extractor function with the found ast.Call,
                     default to get first string argument
 
@@ -191,6 +191,9 @@ def extract_arguments(func, call, members=None):
         calls (set): set of extracted values
         attrs (set): set of attributes
     """
+    if isinstance(call, str):
+        call = (call,)
+
     module = inspect.getmodule(func)
     if not members:
         members = inspect.getmembers(module, inspect.isfunction)
@@ -221,6 +224,13 @@ def extract_arguments(func, call, members=None):
         elif not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
             continue
 
-        if node.func.id == call:
-            calls.add(node.args[0].s)
+        if node.func.id in call:
+            arg = node.args[0]
+            if isinstance(arg, (ast.List, ast.Tuple)):
+                # Batched call, e.g run_queries([("name", args), ...])
+                calls.update(
+                    elt.elts[0].s for elt in arg.elts if isinstance(elt, (ast.List, ast.Tuple))
+                )
+            else:
+                calls.add(arg.s)
     return calls, attrs
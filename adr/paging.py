@@ -0,0 +1,133 @@
+from collections import namedtuple
+
+Column = namedtuple("Column", ["name", "value"])
+
+
+def groupby_columns(query):
+    """Returns the columns a query is grouped by, provided they can be used
+    to page through its result.
+
+    :param dict query: the query.
+    :return list: a Column (name in the result, field queried) for each
+                  groupby column, or None.
+    """
+    groupby = query.get("groupby")
+    if not groupby:
+        return None
+
+    columns = []
+    for column in groupby if isinstance(groupby, list) else [groupby]:
+        if isinstance(column, str):
+            columns.append(Column(column, column))
+        elif isinstance(column, dict) and isinstance(column.get("value"), str):
+            columns.append(Column(column.get("name", column["value"]), column["value"]))
+        else:
+            return None
+    return columns
+
+
+def is_pageable(query, page_size):
+    """Whether a query can (and should) be fetched in pages of `page_size` rows.
+
+    ActiveData has no notion of offset, so pages are delimited by the values
+    of the groupby columns instead (see `page_query`). That requires a query
+    grouped by plain fields, returning rows (`list` or `table` format), with
+    a limit larger than a page.
+    """
+    if not page_size or not groupby_columns(query):
+        return False
+    if any(key in query for key in ("edges", "sort")):
+        return False
+    if query.get("format") not in (None, "list", "table"):
+        return False
+
+    limit = query.get("limit")
+    return isinstance(limit, int) and limit > page_size
+
+
+def _keyset(columns, last):
+    """Builds a clause matching rows sorted after `last`.
+
+    Null values sort last, so nothing comes after a null value of a column.
+    """
+    alternatives = []
+    for i, column in enumerate(columns):
+        if last[i] is None:
+            continue
+
+        clauses = []
+        for prev, value in zip(columns[:i], last[:i]):
+            if value is None:
+                clauses.append({"missing": prev.value})
+            else:
+                clauses.append({"eq": {prev.value: value}})
+        clauses.append({"gt": {column.value: last[i]}})
+        alternatives.append(clauses[0] if len(clauses) == 1 else {"and": clauses})
+
+    if not alternatives:
+        return None
+    return alternatives[0] if len(alternatives) == 1 else {"or": alternatives}
+
+
+def page_query(query, page_size, fetched=0, last=None):
+    """Returns the query retrieving the next page of the result of `query`.
+
+    Rows are sorted by the groupby columns, and each page starts right after
+    the last row of the previous one.
+
+    :param dict query: the query being paged through, see `is_pageable`.
+    :param int page_size: the maximum number of rows in a page.
+    :param int fetched: the number of rows retrieved so far.
+    :param tuple last: the groupby values of the last row retrieved so far,
+                       or None for the first page.
+    :return dict: the query of the page, or None if there are no more pages.
+    """
+    columns = groupby_columns(query)
+    limit = min(page_size, query["limit"] - fetched)
+    if limit <= 0:
+        return None
+
+    page = dict(query, limit=limit, sort=[c.value for c in columns])
+    if last is None:
+        return page
+
+    keyset = _keyset(columns, last)
+    if keyset is None:
+        return None
+
+    if "where" in query:
+        page["where"] = {"and": [query["where"], keyset]}
+    else:
+        page["where"] = keyset
+    return page
+
+
+def _lookup(row, name):
+    if name in row:
+        return row[name]
+
+    # Dotted names may come back as nested objects.
+    value = row
+    for part in name.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def last_key(query, result):
+    """Returns the groupby values of the last row of a page.
+
+    :param dict query: the query being paged through.
+    :param dict result: the result of the page.
+    :return tuple: the values, or None if the page is empty.
+    """
+    data = result.get("data")
+    if not data:
+        return None
+
+    row = data[-1]
+    columns = groupby_columns(query)
+    if "header" in result:
+        return tuple(row[result["header"].index(c.name)] for c in columns)
+    return tuple(_lookup(row, c.name) for c in columns)
@@ -1,22 +1,31 @@
 from __future__ import absolute_import, print_function
 
+import copy
 import datetime
+import hashlib
 import json
-import multiprocessing
 import os
+import threading
 import time
 from argparse import Namespace
-from json import JSONDecodeError
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-import jsone
 import yaml
 from loguru import logger
+from requests.exceptions import RequestException
 
-from adr import config, context, sources
+from adr import compact, config, context, paging, shard, sources
 from adr.context import RequestParser
 from adr.errors import MissingDataError
 from adr.formatter import all_formatters
-from adr.util.req import requests_retry_session
+from adr.template import CompiledTemplate
+from adr.util import OrderedSet, memoize, memoize_file
+from adr.util.cache_stores import CacheEntry
+from adr.util.concurrency import ConcurrencyLimiter, SingleFlight
+from adr.util.jobs import JobHandle, JobPoller
+from adr.util.jsonstream import StreamingObjectParser
+from adr.util.req import iter_content, requests_retry_session, response_json
 
 here = os.path.abspath(os.path.dirname(__file__))
 
@@ -25,7 +34,30 @@ def format_date(timestamp, interval="day"):
     return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
 
 
-activedata_lock = multiprocessing.Lock()
+@memoize
+def _get_limiter(max_concurrency, endpoint_limits):
+    return ConcurrencyLimiter(max_concurrency, dict(endpoint_limits))
+
+
+def get_limiter():
+    """Return the limiter bounding concurrent ActiveData queries.
+
+    The limiter is shared by every caller with the same settings, so changes
+    to the configuration take effect without losing track of in-flight queries.
+    """
+    settings = config["activedata"]
+    return _get_limiter(
+        settings["max_concurrency"], tuple(sorted(settings.get("endpoints", {}).items()))
+    )
+
+
+def _check_response(response):
+    if response.status_code != 200:
+        try:
+            print(json.dumps(response.json(), indent=2))
+        except ValueError:
+            print(response.text)
+        response.raise_for_status()
 
 
 def query_activedata(query, url):
@@ -35,22 +67,101 @@ def query_activedata(query, url):
     :param str url: url to run query
     :returns str: json-formatted string.
     """
-    # Ensure we only run one ActiveData query at a time, to avoid overwhelming it.
-    with activedata_lock:
+    # Bound the number of queries in flight, to avoid overwhelming ActiveData.
+    with get_limiter().acquire(url) as wait_time:
+        logger.debug("Query queue wait time {:.3f} ms".format(wait_time * 1000.0))
         start_time = time.time()
         response = requests_retry_session().post(url, data=query, stream=True)
         logger.debug(
             "Query execution time {:.3f} ms".format((time.time() - start_time) * 1000.0)
         )
+        _check_response(response)
+        return response_json(response)
+
+
+def stream_activedata(query, url, chunk_size=65536):
+    """Runs the provided query against the ActiveData endpoint, yielding
+    the body of the response as it arrives.
+
+    The query keeps its slot in the limiter until the whole body was read
+    (or the generator is closed).
+
+    :param dict query: yaml-formatted query to be run.
+    :param str url: url to run query
+    :param int chunk_size: size in bytes of the yielded chunks.
+    :returns iterator: chunks of the json-formatted response.
+    """
+    with get_limiter().acquire(url) as wait_time:
+        logger.debug("Query queue wait time {:.3f} ms".format(wait_time * 1000.0))
+        start_time = time.time()
+        with requests_retry_session().post(url, data=query, stream=True) as response:
+            logger.debug(
+                "Query response time {:.3f} ms".format((time.time() - start_time) * 1000.0)
+            )
+            _check_response(response)
+            yield from iter_content(response, chunk_size)
+
+
+def _stream_url(url, chunk_size=65536):
+    with requests_retry_session().get(url, stream=True) as response:
+        _check_response(response)
+        yield from iter_content(response, chunk_size)
+
+
+@memoize
+def _get_poller(initial_delay, max_delay, timeout):
+    return JobPoller(requests_retry_session(), initial_delay, max_delay, timeout=timeout)
+
+
+def get_poller():
+    """Return the poller tracking asynchronous ActiveData jobs."""
+    settings = config["activedata"]
+    return _get_poller(
+        settings["poll_initial_delay"], settings["poll_max_delay"], settings["job_timeout"]
+    )
+
+
+def wait_for_job(result):
+    """Waits for an asynchronous ActiveData query to finish.
+
+    :param dict result: response of ActiveData containing the `url` and
+                        `status` of the job.
+    :returns str: url of the query result.
+    """
+    return get_poller().submit(result['url'], result['status']).result()
+
+
+@memoize_file(maxsize=256)
+def _load_query_file(path):
+    """Parses a query file.
 
-        if response.status_code != 200:
-            try:
-                print(json.dumps(response.json(), indent=2))
-            except ValueError:
-                print(response.text)
-            response.raise_for_status()
+    Parsing yaml is slow, so the result is cached until the file changes.
+    Callers must not modify the returned values.
+
+    Returns:
+        tuple: the query (without the context), the query specific context
+        definitions and the names of the contexts used by the query.
+    """
+    with open(path) as fh:
+        query = yaml.load(fh, Loader=yaml.SafeLoader)
+
+    # Extract query and context
+    specific_contexts = query.pop("context") if "context" in query else {}
+    return query, specific_contexts, context.extract_context_names(query)
+
+
+@memoize_file(maxsize=256)
+def _load_query_template(path):
+    return CompiledTemplate(_load_query_file(path)[0])
 
-        return response.json()
+
+@memoize_file(maxsize=256)
+def _load_query_context(path, add_contexts):
+    query, specific_contexts, names = _load_query_file(path)
+    contexts = OrderedSet(names)
+    contexts.update(add_contexts)
+    # Copy the definitions, as argument parsing modifies them in place.
+    return copy.deepcopy(context.get_context_definitions(contexts, specific_contexts))
 
 
 def load_query(name):
@@ -66,12 +177,8 @@ def load_query(name):
         dict query: dictionary representation of yaml query
         (exclude the context).
     """
-    with open(sources.get(name, query=True)) as fh:
-        query = yaml.load(fh, Loader=yaml.SafeLoader)
-        # Remove the context
-        if "context" in query:
-            query.pop("context")
-        return query
+    query = _load_query_file(sources.get(name, query=True))[0]
+    return copy.deepcopy(query)
 
 
 def load_query_context(name, add_contexts=[]):
@@ -84,19 +191,90 @@ def load_query_context(name, add_contexts=[]):
         query_contexts (list): mixed array of strings (name of common contexts)
          and dictionaries (full definition of specific contexts)
     """
-    with open(sources.get(name, query=True)) as fh:
-        query = yaml.load(fh, Loader=yaml.SafeLoader)
-        # Extract query and context
-        specific_contexts = query.pop("context") if "context" in query else {}
-        contexts = context.extract_context_names(query)
-        contexts.update(add_contexts)
-        query_contexts = context.get_context_definitions(contexts, specific_contexts)
+    path = sources.get(name, query=True)
+    return copy.deepcopy(_load_query_context(path, tuple(add_contexts)))
 
-        return query_contexts
 
+PreparedQuery = namedtuple(
+    "PreparedQuery",
+    ["name", "context", "query_str", "key", "legacy_key", "query", "retention", "partial"],
+)
+
+# Operators whose clauses can be reordered without changing the result.
+COMMUTATIVE_OPERATORS = ("and", "or")
+
+
+def _canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def canonicalize_query(query):
+    """Returns a canonical representation of an ActiveData query.
+
+    Clauses of commutative operators (e.g `and`, `or`) are sorted, so
+    equivalent queries have the same representation. Serializing the result
+    with sorted keys (see `query_digest`) makes it independent of dict
+    ordering as well. The query passed in is not modified.
+
+    :param dict query: the rendered query.
+    :return dict: the canonical query.
+    """
+    if isinstance(query, dict):
+        result = {}
+        for key, value in query.items():
+            value = canonicalize_query(value)
+            if key in COMMUTATIVE_OPERATORS and isinstance(value, list):
+                value = sorted(value, key=_canonical_json)
+            result[key] = value
+        return result
+
+    if isinstance(query, list):
+        return [canonicalize_query(v) for v in query]
+
+    return query
+
+
+def query_digest(query):
+    """Returns a stable digest of a canonical query.
+
+    :param dict query: a query returned by `canonicalize_query`.
+    :return str: hex digest.
+    """
+    return hashlib.sha1(_canonical_json(query).encode("utf-8")).hexdigest()
 
-def run_query(name, args, cache=True, regenerate=False):
-    """Loads and runs the specified query, yielding the result.
+
+def _translate_all(value):
+    # translate "all" to a null value (which ActiveData will treat as all)
+    if value == "all":
+        return None
+    if isinstance(value, list):
+        return [None if v == "all" else v for v in value]
+    return value
+
+
+def _render_query(template, context):
+    # The rendered query shares static values with the template, only top
+    # level keys of this copy may be changed.
+    query = dict(template.render(context))
+
+    if "limit" not in query and "limit" in context:
+        query["limit"] = context["limit"]
+    if "format" not in query and "format" in context:
+        query["format"] = context["format"]
+    if config.debug:
+        query["meta"] = {"save": True}
+    return query
+
+
+def _legacy_key(name, template, context):
+    """Cache key of the query as computed by previous versions of adr."""
+    query_str = json.dumps(_render_query(template, context), indent=2, separators=(",", ":"))
+    query_str = query_str.replace('"all"', "null")
+    return f"run_query.{name}.{config.cache._hash(query_str)}"
+
+
+def prepare_query(name, args):
+    """Loads and renders the specified query, without running it.
 
     Given name of a query, this method will first read the query
     from a .query file corresponding to the name.
@@ -104,81 +282,595 @@ def run_query(name, args, cache=True, regenerate=False):
     After queries are loaded, each query to be run is inspected
     and overridden if the provided context has values for limit.
 
-    The actual call to the ActiveData endpoint is encapsulated
-    inside the query_activedata method.
+    Context values of "all" are translated to null, which ActiveData treats
+    as all values.
 
     :param str name: name of the query file to be loaded.
     :param Namespace args: namespace of ActiveData configs.
-    :param bool cache: Defaults to True. It controls if to cache the results.
-    :param bool regenerate: Defaults to False. It controls whether to bypass
-                            the cache and regenerate results.
-    :return str: json-formatted string.
+    :return PreparedQuery: the rendered query along with its cache key.
     """
     context = vars(args)
     formatted_context = ", ".join([f"{k}={v}" for k, v in context.items()])
-    logger.debug(f"Running query '{name}' with context: {formatted_context}")
-    query = load_query(name)
+    template = _load_query_template(sources.get(name, query=True))
+
+    render_context = {k: _translate_all(v) for k, v in context.items()}
+    query = canonicalize_query(_render_query(template, render_context))
+    query_str = json.dumps(query, indent=2, sort_keys=True)
+    key = f"run_query.{name}.{query_digest(query)}"
+
+    legacy_key = None
+    if config["cache"].get("legacy_keys"):
+        legacy_key = _legacy_key(name, template, context)
+
+    return PreparedQuery(
+        name, formatted_context, query_str, key, legacy_key, query, None, False
+    )
+
+
+def _prepare_part(prepared, query, label, retention=None):
+    """Prepares a query fetching part of the result of another one."""
+    query = canonicalize_query(query)
+    return PreparedQuery(
+        prepared.name,
+        f"{prepared.context}, {label}",
+        json.dumps(query, indent=2, sort_keys=True),
+        f"run_query.{prepared.name}.{query_digest(query)}",
+        None,
+        query,
+        retention,
+        True,
+    )
+
+
+def _shard_prepared(prepared):
+    """Splits a prepared query into shards that are cached on their own.
+
+    Sharding is enabled by the `cache.shard` setting, see `adr.shard` for
+    which queries are eligible. Shards that are over and done with are kept
+    for `cache.shard_retention` minutes, the others for `cache.retention`.
+
+    :param PreparedQuery prepared: the query to split.
+    :return list: the PreparedQuery of each shard, or None if the query
+                  isn't sharded.
+    """
+    unit = config["cache"].get("shard")
+    if not unit:
+        return None
+
+    shards = shard.shard_query(prepared.query, unit)
+    if not shards:
+        return None
+
+    logger.debug(f"Splitting query '{prepared.name}' into {len(shards)} shards")
+    return [
+        _prepare_part(
+            prepared,
+            s.query,
+            f"shard={format_date(s.start)}",
+            config["cache"]["shard_retention"] if s.settled else None,
+        )
+        for s in shards
+    ]
 
-    if "limit" not in query and "limit" in context:
-        query["limit"] = context["limit"]
-    if "format" not in query and "format" in context:
-        query["format"] = context["format"]
-    if config.debug:
-        query["meta"] = {"save": True}
 
-    query = jsone.render(query, context)
-    query_str = json.dumps(query, indent=2, separators=(",", ":"))
+# Queries currently running against ActiveData, by cache key.
+inflight = SingleFlight()
 
-    # translate "all" to a null value (which ActiveData will treat as all)
-    query_str = query_str.replace('"all"', "null")
-    query_hash = config.cache._hash(query_str)
 
-    key = f"run_query.{name}.{query_hash}"
-    if cache and not regenerate:
-        result = config.cache.get(key)
+def _log_coalesced(prepared):
+    logger.debug(f"Query '{prepared.name}' was already running, shared its result "
+                 f"({inflight.coalesced} duplicate requests saved so far)")
+
+
+def _cache_put(prepared, result):
+    """Cache the result of a prepared query.
+
+    With `cache.max_staleness` set, the result is wrapped in a CacheEntry
+    that goes stale after `cache.retention` minutes, while the store keeps it
+    around for another `cache.max_staleness` minutes.
+    """
+    retention = prepared.retention or config["cache"]["retention"]
+    max_staleness = config["cache"].get("max_staleness", 0)
+    if max_staleness:
+        result = CacheEntry(result, time.time() + retention * 60)
+    config.cache.put(prepared.key, result, retention + max_staleness)
+
+
+def _revalidate(prepared):
+    """Refresh the cached result of a prepared query in the background."""
+    call, leader = inflight.claim(prepared.key)
+    if not leader:
+        # Already being refreshed (or run).
+        return None
+
+    def refresh():
+        try:
+            result = _finish_query(prepared, _start_query(prepared), True)
+        except Exception as e:
+            logger.warning(f"Failed to refresh stale result of query '{prepared.name}': {e}")
+            inflight.resolve(prepared.key, call, error=e)
+        else:
+            inflight.resolve(prepared.key, call, result)
+
+    logger.debug(f"Serving stale result of query '{prepared.name}' while refreshing it")
+    thread = threading.Thread(target=refresh, name=f"adr-revalidate-{prepared.name}")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def _cache_get_many(prepared):
+    """Retrieve the cache entries of several prepared queries at once, if the
+    cache store supports it (e.g the `s3` store).
+
+    :return dict: the entries by key, to be passed on to `_cache_get`.
+    """
+    store = config.cache.store().get_store()
+    if len(prepared) < 2 or not hasattr(store, "get_many"):
+        return {}
+    return store.get_many(p.key for p in prepared)
+
+
+def _cache_get(prepared, prefetched=None):
+    """Look up the cached result of a prepared query.
+
+    Stale results are returned as is, and refreshed in the background.
+    """
+    if prefetched and prepared.key in prefetched:
+        result = prefetched[prepared.key]
+    else:
+        result = config.cache.get(prepared.key)
+    if result is None and prepared.legacy_key:
+        # Migrate entries cached under the key used by previous versions.
+        result = config.cache.get(prepared.legacy_key)
         if result is not None:
-            return result
+            logger.debug(f"Migrating legacy cache entry for query '{prepared.name}'")
+            _cache_put(prepared, result)
+            config.cache.forget(prepared.legacy_key)
+
+    if isinstance(result, CacheEntry):
+        if result.is_stale():
+            _revalidate(prepared)
+        result = result.value
+    return result
+
 
-    logger.trace(f"JSON representation of query:\n{query_str}")
+def _compact_query(prepared):
+    """Returns the query to send in the compact `table` format, if enabled
+    by the `activedata.compact_format` setting (see `adr.compact`)."""
+    if not config["activedata"]["compact_format"]:
+        return None
+    return compact.compact_query(prepared.query)
+
+
+def _start_query(prepared):
+    """Submit a prepared query to ActiveData.
+
+    :returns: the result, or a JobHandle if ActiveData runs the query
+              asynchronously.
+    """
+    logger.trace(f"JSON representation of query:\n{prepared.query_str}")
+    query_str = prepared.query_str
+    compact_query = _compact_query(prepared)
+    if compact_query:
+        query_str = json.dumps(compact_query, sort_keys=True)
     result = query_activedata(query_str, config.url)
 
     if result.get('url'):
         # We must wait for the content
-        problem = 0
-        i = 0
-        timeout = 300
-        while problem < 3:
-            time.sleep(2)
-            i += 2
-            try:
-                monitor = requests_retry_session().get(result['status']).json()
-                logger.debug(f"waiting: {json.dumps(monitor)}")
-                problem = 0
-                if monitor['status'] == 'done':
-                    result = requests_retry_session().get(result['url']).json()
-                    break
-                elif monitor['status'] == 'error':
-                    raise MissingDataError("Problem with query " + json.dumps(monitor['error']))
-                elif i > timeout:
-                    raise MissingDataError(f"Timed out after {timeout} seconds waiting "
-                                           "for 'done' status")
-                else:
-                    logger.debug(f"status=\"{monitor['status']}\", waiting for \"done\"")
-            except JSONDecodeError:
-                # HAPPENS WHEN ASKING FOR status TOO SOON
-                # (DELAY BETWEEN TIME WRITTEN TO S3 AND TIME AVAILABLE FROM S3)
-                problem += 1
+        return get_poller().submit(result['url'], result['status'])
+    return result
 
+
+def _check_data(prepared, result):
     if not result.get("data"):
-        logger.warning(f"Query '{name}' returned no data with context: {formatted_context}")
+        logger.warning(f"Query '{prepared.name}' returned no data with context: "
+                       f"{prepared.context}")
         logger.debug("JSON Response:\n{response}", response=json.dumps(result, indent=2))
         raise MissingDataError("ActiveData didn't return any data.")
 
+
+def _finish_query(prepared, result, cache):
+    """Retrieve the result of a finished job, then validate and cache it.
+
+    Parts of a query (shards or pages) may legitimately be empty, only the
+    merged result is checked for data.
+    """
+    if isinstance(result, JobHandle):
+        result = response_json(requests_retry_session().get(result.result()))
+
+    if _compact_query(prepared):
+        result = compact.expand_result(prepared.query, result)
+
+    if not prepared.partial:
+        _check_data(prepared, result)
+
     if cache:
-        config.cache.put(key, result, config["cache"]["retention"])
+        _cache_put(prepared, result)
+    return result
+
+
+def fetch_query(prepared, cache=True):
+    """Runs a prepared query against ActiveData, bypassing any cached result.
+
+    The actual call to the ActiveData endpoint is encapsulated
+    inside the query_activedata method.
+
+    Identical queries already in flight (e.g from another thread) are not
+    run again, their result is shared instead.
+
+    :param PreparedQuery prepared: the query to run, see `prepare_query`.
+    :param bool cache: Defaults to True. It controls if to cache the results.
+    :return str: json-formatted string.
+    """
+    result, shared = inflight.do(
+        prepared.key, lambda: _finish_query(prepared, _start_query(prepared), cache)
+    )
+    if shared:
+        _log_coalesced(prepared)
+        # Callers commonly modify the data in place.
+        result = copy.deepcopy(result)
     return result
 
 
+def _merge_parts(prepared, results):
+    result = shard.merge_results(prepared.query, results)
+    _check_data(prepared, result)
+    return result
+
+
+def _is_paged(prepared):
+    return paging.is_pageable(prepared.query, config["activedata"]["page_size"])
+
+
+def _fetch_page(page, cache, regenerate):
+    """Fetch a single page, retrying it on its own if it fails."""
+    if cache and not regenerate:
+        result = _cache_get(page)
+        if result is not None:
+            return result
+
+    retries = config["activedata"]["page_retries"]
+    for attempt in range(retries + 1):
+        try:
+            return fetch_query(page, cache=cache)
+        except (MissingDataError, RequestException) as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"Failed to fetch query '{page.name}' ({page.context}), "
+                           f"retrying: {e}")
+
+
+def _iter_pages(prepared, cache, regenerate):
+    """Yields the result of each page of a prepared query, see `adr.paging`.
+
+    Pages are delimited by the last row of the previous page, so they are
+    fetched one after the other.
+    """
+    page_size = config["activedata"]["page_size"]
+    fetched = 0
+    last = None
+    index = 0
+    while True:
+        query = paging.page_query(prepared.query, page_size, fetched, last)
+        if query is None:
+            return
+
+        result = _fetch_page(_prepare_part(prepared, query, f"page={index}"), cache, regenerate)
+        yield result
+
+        rows = len(result.get("data") or [])
+        fetched += rows
+        if rows < query["limit"]:
+            return
+
+        last = paging.last_key(prepared.query, result)
+        index += 1
+
+
+def _run_paged(prepared, cache, regenerate):
+    logger.debug(f"Fetching query '{prepared.name}' in pages of "
+                 f"{config['activedata']['page_size']} rows")
+    return _merge_parts(prepared, list(_iter_pages(prepared, cache, regenerate)))
+
+
+def run_query(name, args, cache=True, regenerate=False):
+    """Loads and runs the specified query, yielding the result.
+
+    See `prepare_query` for how the query is loaded and `fetch_query` for how
+    it is run. Queries over a date range may be split into shards that are
+    cached and run on their own (see the `cache.shard` setting), while
+    queries with more rows than `activedata.page_size` are fetched page by
+    page.
+
+    :param str name: name of the query file to be loaded.
+    :param Namespace args: namespace of ActiveData configs.
+    :param bool cache: Defaults to True. It controls if to cache the results.
+    :param bool regenerate: Defaults to False. It controls whether to bypass
+                            the cache and regenerate results.
+    :return str: json-formatted string.
+    """
+    prepared = prepare_query(name, args)
+    logger.debug(f"Running query '{name}' with context: {prepared.context}")
+
+    if _is_paged(prepared):
+        return _run_paged(prepared, cache, regenerate)
+
+    shards = _shard_prepared(prepared)
+    if shards:
+        results = _run_prepared(shards, cache, regenerate)
+        return _merge_parts(prepared, [results[s.key] for s in shards])
+
+    if cache and not regenerate:
+        result = _cache_get(prepared)
+        if result is not None:
+            return result
+
+    return fetch_query(prepared, cache=cache)
+
+
+def _run_claimed(prepared, calls, results, cache):
+    """Run queries concurrently, resolving their in-flight calls as they finish."""
+    max_workers = min(len(prepared), config["activedata"]["max_concurrency"])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        started = [(p, executor.submit(_start_query, p)) for p in prepared]
+
+        futures = []
+        for p, future in started:
+            result = future.result()
+            if isinstance(result, JobHandle):
+                # Jobs are all polled by the same background thread, so
+                # waiting on them here doesn't tie up a worker per job.
+                result.result()
+            futures.append((p.key, executor.submit(_finish_query, p, result, cache)))
+
+        for key, future in futures:
+            results[key] = future.result()
+            inflight.resolve(key, calls[key], results[key])
+
+
+def _run_prepared(prepared, cache, regenerate):
+    """Run prepared queries concurrently, skipping duplicates and cached ones.
+
+    :return dict: the result of each query, by cache key.
+    """
+    prefetched = {}
+    if cache and not regenerate:
+        prefetched = _cache_get_many(list(OrderedDict((p.key, p) for p in prepared).values()))
+
+    results = {}
+    pending = OrderedDict()
+    for p in prepared:
+        if p.key in results or p.key in pending:
+            continue
+
+        if cache and not regenerate:
+            result = _cache_get(p, prefetched)
+            if result is not None:
+                results[p.key] = result
+                continue
+
+        logger.debug(f"Running query '{p.name}' with context: {p.context}")
+        pending[p.key] = p
+
+    if pending:
+        # Queries already in flight elsewhere are waited on rather than run again.
+        claimed = OrderedDict()
+        joined = OrderedDict()
+        for key, p in pending.items():
+            call, leader = inflight.claim(key)
+            if leader:
+                claimed[key] = call
+            else:
+                joined[key] = call
+
+        try:
+            if claimed:
+                _run_claimed([pending[key] for key in claimed], claimed, results, cache)
+        except BaseException as e:
+            for key, call in claimed.items():
+                if not call.done():
+                    inflight.resolve(key, call, error=e)
+            raise
+
+        for key, call in joined.items():
+            _log_coalesced(pending[key])
+            results[key] = copy.deepcopy(call.wait())
+
+    return results
+
+
+def run_queries(queries, cache=True, regenerate=False):
+    """Loads and runs several queries at once.
+
+    All queries are rendered up front, so duplicates can be dropped and
+    cached results returned right away. The remaining queries (or their
+    shards and pages, see `run_query`) are run against ActiveData concurrently
+    (bounded by the `activedata.max_concurrency` setting), so the total time
+    is that of the slowest query rather than the sum of them all.
+
+    :param list queries: list of (name, args) tuples, as passed to `run_query`.
+    :param bool cache: Defaults to True. It controls if to cache the results.
+    :param bool regenerate: Defaults to False. It controls whether to bypass
+                            the cache and regenerate results.
+    :return list: the results, in the same order as `queries`.
+    """
+    prepared = [prepare_query(name, args) for name, args in queries]
+
+    plans = OrderedDict()
+    for p in prepared:
+        if p.key not in plans:
+            plans[p.key] = (p, _shard_prepared(p))
+
+    paged = OrderedDict()
+    to_run = []
+    for key, (p, shards) in plans.items():
+        if _is_paged(p):
+            paged[key] = p
+        else:
+            to_run.extend(shards or [p])
+
+    # The pages of a query have to be fetched in order, but those of
+    # different queries are fetched alongside each other.
+    max_workers = min(len(paged), config["activedata"]["max_concurrency"]) or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            (key, executor.submit(_run_paged, p, cache, regenerate)) for key, p in paged.items()
+        ]
+        results = _run_prepared(to_run, cache, regenerate)
+        for key, future in futures:
+            results[key] = future.result()
+
+    for key, (p, shards) in plans.items():
+        if shards:
+            results[key] = _merge_parts(p, [results[s.key] for s in shards])
+
+    # Duplicate queries get their own copy of the result, as callers commonly
+    # modify the data in place.
+    seen = set()
+    ordered = []
+    for p in prepared:
+        result = results[p.key]
+        ordered.append(copy.deepcopy(result) if p.key in seen else result)
+        seen.add(p.key)
+    return ordered
+
+
+def _stream_rows(prepared, chunks, cache, chunk_size, skip):
+    """Yields rows parsed from `chunks`, caching them in chunks of
+    `chunk_size` rows along the way.
+
+    :returns tuple: the parser (holding the other fields of the response) and
+                    the number of rows that were parsed.
+    """
+    stream_key = f"{prepared.key}.stream"
+    retention = config["cache"]["retention"]
+
+    parser = StreamingObjectParser(chunks)
+    buf = []
+    index = 0
+    count = 0
+    for row in parser.rows():
+        count += 1
+        if cache:
+            buf.append(row)
+            if len(buf) >= chunk_size:
+                # Chunks outlive their header by a minute, so that a header
+                # hit can always find all of its chunks.
+                config.cache.put(f"{stream_key}.{index}", buf, retention + 1)
+                index += 1
+                buf = []
+
+        if count > skip:
+            yield row
+
+    if cache and count:
+        if buf:
+            config.cache.put(f"{stream_key}.{index}", buf, retention + 1)
+            index += 1
+        header = dict(parser.fields, chunks=index)
+        config.cache.put(stream_key, header, retention)
+
+    return parser, count
+
+
+def stream_query(name, args, cache=True, regenerate=False, chunk_size=10000):
+    """Loads and runs the specified query, yielding the rows of its data one
+    at a time.
+
+    Unlike `run_query`, the response is parsed as it arrives so rows can be
+    used before the whole result was downloaded, and the full result is
+    never held in memory. Rows are cached in chunks of `chunk_size` rows.
+
+    Only queries whose `data` is an array (e.g the `list` or `table`
+    formats) can be streamed.
+
+    :param str name: name of the query file to be loaded.
+    :param Namespace args: namespace of ActiveData configs.
+    :param bool cache: Defaults to True. It controls if to cache the results.
+    :param bool regenerate: Defaults to False. It controls whether to bypass
+                            the cache and regenerate results.
+    :param int chunk_size: Number of rows stored in each cache entry.
+    :return iterator: rows of the result.
+    """
+    prepared = prepare_query(name, args)
+    logger.debug(f"Running query '{name}' with context: {prepared.context}")
+    stream_key = f"{prepared.key}.stream"
+
+    skip = 0
+    if cache and not regenerate:
+        result = _cache_get(prepared)
+        if result is not None:
+            yield from result["data"]
+            return
+
+        header = config.cache.get(stream_key)
+        if header is not None:
+            for i in range(header["chunks"]):
+                rows = config.cache.get(f"{stream_key}.{i}")
+                if rows is None:
+                    logger.warning(f"Cached chunk {i} of query '{name}' is missing, "
+                                   "running the query again")
+                    break
+
+                skip += len(rows)
+                yield from rows
+            else:
+                return
+
+    logger.trace(f"JSON representation of query:\n{prepared.query_str}")
+    chunks = stream_activedata(prepared.query_str, config.url)
+    parser, count = yield from _stream_rows(prepared, chunks, cache, chunk_size, skip)
+
+    if not parser.found and parser.fields.get('url'):
+        # We must wait for the content
+        url = wait_for_job(parser.fields)
+        parser, count = yield from _stream_rows(
+            prepared, _stream_url(url), cache, chunk_size, skip
+        )
+
+    if not parser.found and parser.fields.get("data"):
+        raise ValueError(f"Query '{name}' can't be streamed, its data is not an array. "
+                         "Use the 'list' or 'table' format instead.")
+
+    if not count:
+        logger.warning(f"Query '{name}' returned no data with context: {prepared.context}")
+        raise MissingDataError("ActiveData didn't return any data.")
+
+
+def paginate_query(name, args, cache=True, regenerate=False):
+    """Loads and runs the specified query, yielding the rows of its data one
+    at a time.
+
+    Queries with more rows than `activedata.page_size` are fetched page by
+    page, each page being cached on its own. Rows are yielded as soon as
+    their page arrived, and a page that failed is retried (up to
+    `activedata.page_retries` times) without fetching the previous pages
+    again. Other queries are run with `run_query`.
+
+    :param str name: name of the query file to be loaded.
+    :param Namespace args: namespace of ActiveData configs.
+    :param bool cache: Defaults to True. It controls if to cache the results.
+    :param bool regenerate: Defaults to False. It controls whether to bypass
+                            the cache and regenerate results.
+    :return iterator: rows of the result.
+    """
+    prepared = prepare_query(name, args)
+    if not _is_paged(prepared):
+        yield from run_query(name, args, cache=cache, regenerate=regenerate)["data"]
+        return
+
+    count = 0
+    for result in _iter_pages(prepared, cache, regenerate):
+        data = result.get("data") or []
+        count += len(data)
+        yield from data
+
+    if not count:
+        logger.warning(f"Query '{name}' returned no data with context: {prepared.context}")
+        raise MissingDataError("ActiveData didn't return any data.")
+
+
 def format_query(query, remainder=[]):
     """Takes the output of the ActiveData query and performs formatting.
 
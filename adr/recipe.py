@@ -39,7 +39,9 @@ def get_recipe_contexts(recipe):
     mod = get_module(recipe)
 
     # try to extract name of query and run contexts automatically from run function
-    queries, run_contexts = context.extract_arguments(mod.run, "run_query")
+    queries, run_contexts = context.extract_arguments(
+        mod.run, ("run_query", "run_queries", "stream_query", "paginate_query")
+    )
 
     specific_contexts = collections.OrderedDict()
     if hasattr(mod, "RUN_CONTEXTS"):
@@ -0,0 +1,262 @@
+import calendar
+import datetime
+import re
+import time
+from collections import namedtuple
+
+# Length in seconds of the units queries can be sharded by.
+UNITS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "week": 604800,
+}
+
+# Splitting a query into more shards than this costs more than it saves.
+MAX_SHARDS = 400
+
+# Data keeps trickling into ActiveData for a while, so a shard is only
+# considered final once it ended at least this many seconds ago.
+SETTLE_TIME = 3600
+
+DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S")
+RELATIVE_DATE_RE = re.compile(
+    r"^(now|today|tomorrow|eod)((?:[+-]\d*(?:second|minute|hour|day|week|month|year)s?)*)$"
+)
+OFFSET_RE = re.compile(r"([+-])(\d*)(second|minute|hour|day|week|month|year)s?")
+
+LOWER_OPERATORS = ("gt", "gte")
+UPPER_OPERATORS = ("lt", "lte")
+
+Bound = namedtuple("Bound", ["index", "op", "field", "timestamp"])
+TimeRange = namedtuple("TimeRange", ["field", "lower", "upper", "rest"])
+Shard = namedtuple("Shard", ["query", "start", "end", "settled"])
+
+
+def _add_months(dt, months):
+    month = dt.month - 1 + months
+    year = dt.year + month // 12
+    month = month % 12 + 1
+    return dt.replace(year=year, month=month, day=min(dt.day, calendar.monthrange(year, month)[1]))
+
+
+def _timestamp(dt):
+    return calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6
+
+
+def parse_date(value, now=None):
+    """Returns the timestamp described by an ActiveData date expression.
+
+    Supported are timestamps, dates (e.g `2020-01-31`) and dates relative to
+    `now`, `today`, `tomorrow` or `eod` (e.g `today-2week`). All dates are in
+    UTC, like in ActiveData.
+
+    :param value: the date expression.
+    :param float now: the current timestamp (defaults to the current time).
+    :return float: the timestamp, or None if the expression isn't supported.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return _timestamp(datetime.datetime.strptime(value, fmt))
+        except ValueError:
+            pass
+
+    match = RELATIVE_DATE_RE.match(value.replace(" ", "").lower())
+    if not match:
+        return None
+
+    base, offsets = match.groups()
+    dt = datetime.datetime.utcfromtimestamp(time.time() if now is None else now)
+    if base != "now":
+        dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        if base in ("tomorrow", "eod"):
+            dt += datetime.timedelta(days=1)
+
+    for sign, amount, unit in OFFSET_RE.findall(offsets):
+        amount = int(amount or 1) * (-1 if sign == "-" else 1)
+        if unit == "month":
+            dt = _add_months(dt, amount)
+        elif unit == "year":
+            dt = _add_months(dt, amount * 12)
+        else:
+            dt += datetime.timedelta(seconds=amount * UNITS[unit])
+    return _timestamp(dt)
+
+
+def _parse_bound(index, clause, now):
+    """Parses a clause like `{"gte": {"field": {"date": "today-week"}}}`."""
+    if not isinstance(clause, dict) or len(clause) != 1:
+        return None
+
+    op, operand = next(iter(clause.items()))
+    if op not in LOWER_OPERATORS + UPPER_OPERATORS:
+        return None
+
+    if isinstance(operand, dict) and len(operand) == 1:
+        field, value = next(iter(operand.items()))
+    elif isinstance(operand, list) and len(operand) == 2 and isinstance(operand[0], str):
+        field, value = operand
+    else:
+        return None
+
+    # Strings are only dates when wrapped in the date operator.
+    if isinstance(value, dict) and list(value) == ["date"]:
+        timestamp = parse_date(value["date"], now)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        timestamp = float(value)
+    else:
+        return None
+
+    if timestamp is None:
+        return None
+    return Bound(index, op, field, timestamp)
+
+
+def is_shardable(query):
+    """Whether the result of a query is the concatenation of the results of its shards.
+
+    That's the case for queries returning plain records (`list` or `table`
+    format) in no particular order. Queries without an explicit limit are
+    excluded, as each shard would be subject to ActiveData's default limit.
+    """
+    if any(key in query for key in ("edges", "groupby", "having", "sort")):
+        return False
+    if query.get("format", "list") not in ("list", "table"):
+        return False
+    if not isinstance(query.get("limit"), int):
+        return False
+
+    select = query.get("select")
+    for s in select if isinstance(select, list) else [select]:
+        if isinstance(s, dict) and s.get("aggregate", "none") != "none":
+            return False
+    return True
+
+
+def find_time_range(query, now=None):
+    """Find the date range a query filters on.
+
+    Only range clauses at the top of the `where` clause (or of its `and`
+    clause) are considered. The first field with a single lower bound (and at
+    most a single upper bound) is picked.
+
+    :param dict query: the query.
+    :param float now: the current timestamp (defaults to the current time).
+    :return TimeRange: the range along with the remaining clauses, or None.
+    """
+    where = query.get("where")
+    if where is None:
+        return None
+
+    if isinstance(where, dict) and list(where) == ["and"] and isinstance(where["and"], list):
+        clauses = where["and"]
+    else:
+        clauses = [where]
+
+    bounds = {}
+    for i, clause in enumerate(clauses):
+        bound = _parse_bound(i, clause, now)
+        if bound:
+            bounds.setdefault(bound.field, []).append(bound)
+
+    for field, field_bounds in bounds.items():
+        lower = [b for b in field_bounds if b.op in LOWER_OPERATORS]
+        upper = [b for b in field_bounds if b.op in UPPER_OPERATORS]
+        if len(lower) != 1 or len(upper) > 1:
+            continue
+
+        used = {b.index for b in field_bounds}
+        rest = [c for i, c in enumerate(clauses) if i not in used]
+        return TimeRange(field, lower[0], upper[0] if upper else None, rest)
+    return None
+
+
+def _number(timestamp):
+    return int(timestamp) if float(timestamp).is_integer() else timestamp
+
+
+def shard_query(query, unit="day", now=None):
+    """Splits a query filtering on a date range into one query per `unit` of time.
+
+    Shards are aligned on multiples of `unit` (in UTC), so the same shards
+    come up again when the range moves, e.g from one day to the next.
+    Relative dates (e.g `today-week`) are resolved, so the shards describe a
+    fixed period of time. A range ending in the future (e.g at `eod`) is left
+    open, which only makes a difference for data dated in the future.
+
+    :param dict query: the query, see `is_shardable` for which are supported.
+    :param str unit: the length of each shard, one of `UNITS`.
+    :param float now: the current timestamp (defaults to the current time).
+    :return list: the Shard of each period in chronological order, or None
+                  if the query can't be sharded.
+    """
+    if unit not in UNITS:
+        raise ValueError(f"Unknown shard unit '{unit}', must be one of: {', '.join(UNITS)}")
+
+    now = time.time() if now is None else now
+    if not is_shardable(query):
+        return None
+
+    time_range = find_time_range(query, now)
+    if not time_range:
+        return None
+
+    start = time_range.lower.timestamp
+    end = time_range.upper.timestamp if time_range.upper else None
+    if end is not None and end >= now:
+        end = None
+
+    size = UNITS[unit]
+    edges = [start]
+    edge = (start // size + 1) * size
+    while edge < (now if end is None else end):
+        edges.append(edge)
+        if len(edges) > MAX_SHARDS:
+            return None
+        edge += size
+
+    field = time_range.field
+    shards = []
+    for i, shard_start in enumerate(edges):
+        last = i == len(edges) - 1
+        clauses = list(time_range.rest)
+        clauses.append({time_range.lower.op if i == 0 else "gte": {field: _number(shard_start)}})
+
+        if not last:
+            shard_end = edges[i + 1]
+            clauses.append({"lt": {field: _number(shard_end)}})
+        else:
+            shard_end = end
+            if end is not None:
+                clauses.append({time_range.upper.op: {field: _number(end)}})
+
+        settled = shard_end is not None and shard_end + SETTLE_TIME <= now
+        shards.append(Shard(dict(query, where={"and": clauses}), shard_start, shard_end, settled))
+    return shards
+
+
+def merge_results(query, results):
+    """Merges the results of the shards of a query back together.
+
+    :param dict query: the query that was sharded.
+    :param list results: the result of each shard, in chronological order.
+    :return dict: the result of the query.
+    """
+    merged = dict(results[0])
+    data = []
+    for result in results:
+        data.extend(result.get("data") or [])
+
+    if query.get("limit") is not None:
+        data = data[:query["limit"]]
+    merged["data"] = data
+    return merged
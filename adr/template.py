@@ -0,0 +1,175 @@
+import json
+import re
+
+from jsone import builtins
+from jsone.interpreter import ExpressionEvaluator
+from jsone.prattparser import ParseContext, SyntaxError
+from jsone.render import operators, renderValue
+from jsone.shared import DeleteMarker, JSONTemplateError, TemplateError, fromNow
+
+CONTEXT_RE = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*$')
+INTERPOLATION_RE = re.compile(r'\$?\${')
+
+
+class RenderContext(object):
+    def __init__(self, context):
+        """The context a template is rendered with.
+
+        Most expressions only look up a value that was passed in, so the
+        builtins json-e adds to the context are only set up when needed.
+        """
+        if not all(CONTEXT_RE.match(c) for c in context):
+            raise TemplateError('top level keys of context must follow '
+                                '/[a-zA-Z_][a-zA-Z0-9_]*/')
+        self.context = context
+        self._full = None
+
+    @property
+    def full(self):
+        if self._full is None:
+            full = {'now': fromNow('0 seconds', None)}
+            full.update(builtins.build(full))
+            full.update(self.context)
+            self._full = full
+        return self._full
+
+
+class Static(object):
+    def __init__(self, value):
+        self.value = value
+
+    def render(self, ctx):
+        return self.value
+
+
+class Dynamic(object):
+    def __init__(self, template):
+        self.template = template
+
+    def render(self, ctx):
+        return renderValue(self.template, ctx.full)
+
+
+class Eval(object):
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = list(ExpressionEvaluator({})._generate_tokens(expression))
+
+        self.identifier = None
+        if len(self.tokens) == 1 and self.tokens[0].kind == 'identifier':
+            self.identifier = self.tokens[0].value
+
+    def render(self, ctx):
+        if self.identifier in ctx.context:
+            return ctx.context[self.identifier]
+
+        evaluator = ExpressionEvaluator(ctx.full)
+        pc = ParseContext(evaluator, self.expression, iter(self.tokens))
+        result = pc.parse()
+        token = pc.attempt()
+        if token:
+            raise SyntaxError.unexpected(token, evaluator.infix_rules)
+        return result
+
+
+class Object(object):
+    def __init__(self, items):
+        self.items = items
+
+    def render(self, ctx):
+        result = {}
+        for key, node in self.items:
+            try:
+                value = node.render(ctx)
+            except JSONTemplateError as e:
+                if CONTEXT_RE.match(key):
+                    e.add_location('.{}'.format(key))
+                else:
+                    e.add_location('[{}]'.format(json.dumps(key)))
+                raise
+            if value is not DeleteMarker:
+                result[key] = value
+        return result
+
+
+class Array(object):
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def render(self, ctx):
+        result = []
+        for i, node in enumerate(self.nodes):
+            try:
+                value = node.render(ctx)
+            except JSONTemplateError as e:
+                e.add_location('[{}]'.format(i))
+                raise
+            if value is not DeleteMarker:
+                result.append(value)
+        return result
+
+
+def compile_node(template):
+    """Compile a template into a tree of nodes that can be rendered."""
+    if isinstance(template, str):
+        if INTERPOLATION_RE.search(template):
+            return Dynamic(template)
+        return Static(template)
+
+    if isinstance(template, dict):
+        if any(k in operators for k in template):
+            if list(template) == ['$eval'] and isinstance(template['$eval'], str):
+                try:
+                    return Eval(template['$eval'])
+                except TemplateError:
+                    # Let json-e report the error when the template is rendered.
+                    pass
+            return Dynamic(template)
+
+        # Escaped or interpolated keys are left to json-e.
+        if any(k.startswith('$') or INTERPOLATION_RE.search(k) for k in template):
+            return Dynamic(template)
+
+        items = [(k, compile_node(v)) for k, v in template.items()]
+        if all(isinstance(node, Static) for _, node in items):
+            return Static(template)
+        return Object(items)
+
+    if isinstance(template, list):
+        nodes = [compile_node(v) for v in template]
+        if all(isinstance(node, Static) for node in nodes):
+            return Static(template)
+        return Array(nodes)
+
+    return Static(template)
+
+
+class CompiledTemplate(object):
+    def __init__(self, template):
+        """A json-e template compiled once to be rendered many times.
+
+        `jsone.render` interprets the whole template on every call and
+        re-tokenizes each expression along the way. Here static subtrees are
+        returned by reference without being walked again and `$eval`
+        expressions are tokenized ahead of time, anything else is handed to
+        json-e as is.
+
+        Rendering produces the same result as `jsone.render`, except that
+        static parts of the template are shared between the template and
+        every rendered result. Results must therefore not be modified in
+        place (beyond replacing top level keys of a copy).
+
+        Args:
+            template (dict): The json-e template.
+        """
+        self.template = template
+        self.root = compile_node(template)
+
+    def render(self, context):
+        rv = self.root.render(RenderContext(context))
+        if rv is DeleteMarker:
+            return None
+        if callable(rv):
+            raise TemplateError(('$eval {} doesn\'t get any arguments '
+                                 'in template').format(self.template['$eval']))
+        return rv
@@ -1,2 +1,2 @@
 from .datastructures import OrderedSet  # noqa
-from .memoize import memoize, memoized_property  # noqa
+from .memoize import memoize, memoize_file, memoized_property  # noqa
@@ -1,14 +1,20 @@
 import os
 import pickle
+import random
 import shutil
 import tarfile
 import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from distutils.dir_util import copy_tree
 
 import boto3
 import botocore
 import taskcluster
 import zstandard
+from botocore.config import Config
 from cachy.contracts.store import Store
 from cachy.serializers import Serializer
 from cachy.stores import FileStore, NullStore  # noqa
@@ -26,6 +32,29 @@ def extract_tar_zst(path, dest):
                 tar.extractall(dest)
 
 
+class CacheEntry(object):
+    """A cached value that goes stale before it expires.
+
+    The store holding the entry enforces its hard expiry, the soft expiry
+    travels with the value so it works with any store.
+    """
+
+    __slots__ = ("value", "soft_expiry")
+
+    def __init__(self, value, soft_expiry):
+        self.value = value
+        self.soft_expiry = soft_expiry
+
+    def __getstate__(self):
+        return (self.value, self.soft_expiry)
+
+    def __setstate__(self, state):
+        self.value, self.soft_expiry = state
+
+    def is_stale(self):
+        return time.time() >= self.soft_expiry
+
+
 class SeededFileStore(FileStore):
     RESEED_KEY = "adr:SeededFileStore:reseed"
 
@@ -124,6 +153,158 @@ class RenewingFileStore(FileStore):
         return value
 
 
+class MemoryStore(Store):
+    def __init__(self, store, max_size, ttl=0):
+        """An in-process LRU cache in front of another store.
+
+        Reads are served from memory when possible, and otherwise read
+        through to the backing store. Writes go to both. Values are kept
+        pickled (but not compressed), so each hit hands out a fresh copy that
+        callers are free to modify.
+
+        Args:
+            store (Store): The backing store.
+            max_size (int): Maximum size in bytes of the values kept in memory.
+            ttl (float): Maximum time in minutes a value is kept in memory
+                         (defaults to no limit beyond its expiry in the
+                         backing store, when known).
+        """
+        self.store = store
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.size -= len(entry[0])
+
+    def _remember(self, key, value, minutes=None):
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            data = None
+
+        ttl = min(m for m in (minutes, self.ttl) if m) if minutes or self.ttl else None
+        expiry = time.time() + ttl * 60 if ttl else None
+
+        with self._lock:
+            self._forget(key)
+            if data is None or len(data) > self.max_size:
+                return
+
+            self._entries[key] = (data, expiry)
+            self.size += len(data)
+            while self.size > self.max_size:
+                self._forget(next(iter(self._entries)))
+
+    def get(self, key):
+        data = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                if entry[1] is None or entry[1] > time.time():
+                    self._entries.move_to_end(key)
+                    data = entry[0]
+                else:
+                    self._forget(key)
+
+        if data is not None:
+            return pickle.loads(data)
+
+        value = self.store.get(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value, minutes):
+        self.store.put(key, value, minutes)
+        self._remember(key, value, minutes)
+
+    def forever(self, key, value):
+        self.store.forever(key, value)
+        self._remember(key, value)
+
+    def increment(self, key, value=1):
+        with self._lock:
+            self._forget(key)
+        return self.store.increment(key, value)
+
+    def decrement(self, key, value=1):
+        with self._lock:
+            self._forget(key)
+        return self.store.decrement(key, value)
+
+    def forget(self, key):
+        with self._lock:
+            self._forget(key)
+        return self.store.forget(key)
+
+    def flush(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        return self.store.flush()
+
+    def get_many(self, keys):
+        """Retrieve several items at once, see `S3Store.get_many`."""
+        result = {}
+        missing = []
+        for key in keys:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and (entry[1] is None or entry[1] > time.time()):
+                    self._entries.move_to_end(key)
+                    result[key] = entry[0]
+                    continue
+            missing.append(key)
+
+        result = {k: pickle.loads(v) for k, v in result.items()}
+        if missing:
+            if hasattr(self.store, "get_many"):
+                fetched = self.store.get_many(missing)
+            else:
+                fetched = {key: self.store.get(key) for key in missing}
+
+            for key, value in fetched.items():
+                if value is not None:
+                    self._remember(key, value)
+            result.update(fetched)
+        return result
+
+    def put_many(self, items, minutes):
+        if hasattr(self.store, "put_many"):
+            self.store.put_many(items, minutes)
+        else:
+            for key, value in items.items():
+                self.store.put(key, value, minutes)
+
+        for key, value in items.items():
+            self._remember(key, value, minutes)
+
+    def forget_many(self, keys):
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._forget(key)
+
+        if hasattr(self.store, "forget_many"):
+            return self.store.forget_many(keys)
+        for key in keys:
+            self.store.forget(key)
+        return True
+
+    def get_prefix(self):
+        return self.store.get_prefix()
+
+    def set_serializer(self, serializer):
+        self.store.set_serializer(serializer)
+        return self
+
+
 def get_taskcluster_options():
     """
     Helper to get the Taskcluster setup options
@@ -150,12 +331,41 @@ def get_s3_credentials(bucket, prefix):
 
 
 class S3Store(Store):
+    # Maximum number of keys accepted by a single DeleteObjects request.
+    DELETE_BATCH_SIZE = 1000
+
     def __init__(self, config):
         """A Store instance that stores items in S3.
+
+        Items are renewed when they are accessed, so that an S3 Object
+        Expiration policy only removes items which are not used anymore.
+        Renewing means copying the object onto itself, which is done in the
+        background (one item after the other) and at most once every
+        `renew_interval` minutes per item, so a cache hit only costs a single
+        GET request.
+
+        Configuration can include:
+
+            bucket: Name of the S3 bucket.
+            prefix: Prefix of the keys of the items in the bucket.
+            renew_interval: Time in minutes after which an item accessed again
+                            gets renewed (defaults to a day).
+            max_connections: Maximum number of concurrent requests made by
+                             the bulk operations (defaults to 32).
         """
         self._bucket = config["bucket"]
         self._prefix = config["prefix"]
+        self._renew_interval = config.get("renew_interval", 1440) * 60
+        self._max_connections = config.get("max_connections", 32)
         self._create_client()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        # Time of the last renewal of items, as known to this process.
+        self._renewed = {}
+        self._renewals = OrderedDict()
+        self._renew_lock = threading.Lock()
+        self._renewer = None
 
     def _create_client(self):
         credentials = get_s3_credentials(self._bucket, self._prefix)
@@ -164,6 +374,7 @@ class S3Store(Store):
             aws_access_key_id=credentials["accessKeyId"],
             aws_secret_access_key=credentials["secretAccessKey"],
             aws_session_token=credentials["sessionToken"],
+            config=Config(max_pool_connections=self._max_connections),
         )
 
     def _key(self, key):
@@ -185,15 +396,13 @@ class S3Store(Store):
     def forget(self, key):
         return self._retry_if_expired(lambda: self._forget(key))
 
-    def _get(self, key):
-        # Copy the object onto itself to extend its expiration.
-        try:
-            head = self.client.head_object(Bucket=self._bucket, Key=self._key(key))
-
-            # Change its metadata, or Amazon will complain.
-            metadata = head["Metadata"]
-            metadata["id"] = "1" if "id" in metadata and metadata["id"] == "0" else "0"
+    def _renew(self, key, metadata):
+        # Copy the object onto itself to extend its expiration. Its metadata
+        # has to change, or Amazon will complain.
+        metadata = dict(metadata)
+        metadata["id"] = "1" if metadata.get("id") == "0" else "0"
 
+        try:
             self.client.copy_object(
                 Bucket=self._bucket,
                 CopySource={"Bucket": self._bucket, "Key": self._key(key)},
@@ -202,19 +411,64 @@ class S3Store(Store):
                 MetadataDirective="REPLACE",
             )
         except botocore.exceptions.ClientError as ex:
-            if ex.response["Error"]["Code"] == "404":
+            # The item may have been deleted in the meantime.
+            if ex.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+
+    def _run_renewals(self):
+        while True:
+            with self._renew_lock:
+                if not self._renewals:
+                    self._renewer = None
+                    return
+                key, metadata = self._renewals.popitem(last=False)
+
+            try:
+                self._retry_if_expired(lambda: self._renew(key, metadata))
+            except Exception as e:
+                logger.warning(f"Failed to renew cache item '{key}': {e}")
+
+    def _schedule_renewal(self, key, last_modified, metadata):
+        now = time.time()
+        with self._renew_lock:
+            last_renewed = max(self._renewed.get(key, 0), last_modified)
+            if now - last_renewed < self._renew_interval or key in self._renewals:
+                return
+
+            self._renewed[key] = now
+            self._renewals[key] = metadata
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._run_renewals, name="adr-s3-renew")
+                self._renewer.daemon = True
+                self._renewer.start()
+
+    def wait_for_renewals(self):
+        """Block until all scheduled renewals are done."""
+        renewer = self._renewer
+        if renewer:
+            renewer.join()
+
+    def _get(self, key):
+        try:
+            response = self.client.get_object(Bucket=self._bucket, Key=self._key(key))
+        except botocore.exceptions.ClientError as ex:
+            if ex.response["Error"]["Code"] in ("404", "NoSuchKey"):
                 return None
             raise
 
-        response = self.client.get_object(Bucket=self._bucket, Key=self._key(key))
         data = response["Body"].read()
         try:
-            return self.unserialize(data)
+            value = self.unserialize(data)
         except Exception:
             # The object is broken, let's delete it.
             self.forget(key)
             return None
 
+        self._schedule_renewal(
+            key, response["LastModified"].timestamp(), response.get("Metadata", {})
+        )
+        return value
+
     def get(self, key):
         return self._retry_if_expired(lambda: self._get(key))
 
@@ -225,15 +479,236 @@ class S3Store(Store):
 
     def put(self, key, value, minutes):
         self._retry_if_expired(lambda: self._put(key, value))
+        with self._renew_lock:
+            self._renewed[key] = time.time()
+
+    def _map(self, fn, items):
+        """Call `fn` on every item concurrently, returns the results in order."""
+        items = list(items)
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_connections, thread_name_prefix="adr-s3"
+                )
+        return list(self._executor.map(fn, items))
+
+    def get_many(self, keys):
+        """Retrieve several items at once.
+
+        Returns:
+            dict: The value of each key, None for the missing ones.
+        """
+        keys = list(keys)
+        return dict(zip(keys, self._map(self.get, keys)))
+
+    def put_many(self, items, minutes):
+        """Store several items (a dict of key to value) at once."""
+        self._map(lambda item: self.put(item[0], item[1], minutes), items.items())
+
+    def _forget_batch(self, keys):
+        response = self.client.delete_objects(
+            Bucket=self._bucket,
+            Delete={"Objects": [{"Key": self._key(k)} for k in keys], "Quiet": True},
+        )
+        for error in response.get("Errors", []):
+            logger.warning(f"Failed to delete cache item '{error['Key']}': {error['Message']}")
+
+    def forget_many(self, keys):
+        """Remove several items at once, in batches of up to 1000 keys."""
+        keys = list(keys)
+        batches = [keys[i:i + self.DELETE_BATCH_SIZE]
+                   for i in range(0, len(keys), self.DELETE_BATCH_SIZE)]
+        self._map(lambda batch: self._retry_if_expired(lambda: self._forget_batch(batch)), batches)
+        return True
 
 
 class CompressedPickleSerializer(Serializer):
-    def __init__(self):
-        self.compressor = zstandard.ZstdCompressor(level=zstandard.MAX_COMPRESSION_LEVEL)
-        self.decompressor = zstandard.ZstdDecompressor()
+    ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+    def __init__(self, level=10, threads=0, protocol=None, min_size=512):
+        """Pickles values and compresses them with zstd.
+
+        Values are readable whatever the settings they were written with.
+
+        Args:
+            level (int): zstd compression level, from 1 (fastest) to 22 (smallest).
+            threads (int): Number of threads compressing each value (0 to
+                           compress in the calling thread, -1 for one per CPU).
+            protocol (int): Pickle protocol (defaults to 5 when supported).
+            min_size (int): Pickled values smaller than this many bytes are
+                            stored uncompressed.
+        """
+        self.level = level
+        self.threads = threads
+        self.protocol = min(5, pickle.HIGHEST_PROTOCOL) if protocol is None else protocol
+        self.min_size = min_size
+        # zstd (de)compressors can't be used by several threads at once.
+        self._local = threading.local()
+
+    @property
+    def compressor(self):
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(
+                level=self.level, threads=self.threads
+            )
+        return self._local.compressor
+
+    @property
+    def decompressor(self):
+        if not hasattr(self._local, "decompressor"):
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local.decompressor
 
     def serialize(self, data):
-        return self.compressor.compress(pickle.dumps(data))
+        data = pickle.dumps(data, protocol=self.protocol)
+        if len(data) < self.min_size:
+            return data
+        return self.compressor.compress(data)
+
+    def unserialize(self, data):
+        # Pickles never start with the zstd magic number.
+        if bytes(data[:4]) == self.ZSTD_MAGIC:
+            data = self.decompressor.decompress(data)
+        return pickle.loads(data)
+
+
+class CompressedPickleDictSerializer(CompressedPickleSerializer):
+    def __init__(self, path=None, **kwargs):
+        """A CompressedPickleSerializer compressing with a zstd dictionary.
+
+        Cached results share a lot of structure (keys, column names, ...)
+        which compressing each of them separately can't take advantage of.
+        A dictionary trained on a sample of them (see `train`) captures it
+        once for all.
+
+        Dictionaries are kept in `path` as `<dict_id>.zdict` files, the most
+        recent one is used for compression. Each compressed entry records the
+        ID of its dictionary, so entries remain readable as long as the
+        dictionary they were written with is around. Without any dictionary,
+        this behaves like CompressedPickleSerializer.
+
+        Args:
+            path (str): Directory holding the dictionaries.
+            kwargs: Passed on to CompressedPickleSerializer.
+        """
+        super(CompressedPickleDictSerializer, self).__init__(**kwargs)
+        self.path = path
+        self._dicts = {}
+        self._dict_id = None
+        self._dict_lock = threading.Lock()
+
+    def _dict_path(self, dict_id):
+        return os.path.join(self.path, f"{dict_id}.zdict")
+
+    def _load(self, dict_id):
+        with self._dict_lock:
+            if dict_id not in self._dicts:
+                with open(self._dict_path(dict_id), "rb") as fh:
+                    self._dicts[dict_id] = zstandard.ZstdCompressionDict(fh.read())
+            return self._dicts[dict_id]
+
+    @property
+    def dict_id(self):
+        """ID of the dictionary used for compression, 0 if there is none."""
+        if self._dict_id is None:
+            latest = (0, 0)
+            if self.path and os.path.isdir(self.path):
+                for name in os.listdir(self.path):
+                    stem, ext = os.path.splitext(name)
+                    if ext == ".zdict" and stem.isdigit():
+                        mtime = os.path.getmtime(os.path.join(self.path, name))
+                        latest = max(latest, (mtime, int(stem)))
+            self._dict_id = latest[1]
+        return self._dict_id
+
+    @property
+    def compressor(self):
+        dict_id = self.dict_id
+        if getattr(self._local, "compressor_dict_id", None) != dict_id:
+            self._local.compressor = zstandard.ZstdCompressor(
+                level=self.level,
+                threads=self.threads,
+                dict_data=self._load(dict_id) if dict_id else None,
+            )
+            self._local.compressor_dict_id = dict_id
+        return self._local.compressor
 
     def unserialize(self, data):
-        return pickle.loads(self.decompressor.decompress(data))
+        if bytes(data[:4]) != self.ZSTD_MAGIC:
+            return pickle.loads(data)
+
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        if not dict_id:
+            return super(CompressedPickleDictSerializer, self).unserialize(data)
+
+        decompressors = self._local.__dict__.setdefault("decompressors", {})
+        if dict_id not in decompressors:
+            try:
+                dict_data = self._load(dict_id)
+            except (OSError, TypeError):
+                # Treat the entry as missing, it will be fetched again.
+                logger.warning(f"Cache dictionary {dict_id} is missing from {self.path}")
+                return None
+            decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dict_data)
+        return pickle.loads(decompressors[dict_id].decompress(data))
+
+    def train(self, samples, size=112640):
+        """Train a dictionary and use it from now on.
+
+        Args:
+            samples (list): Sample values, as stored in the cache.
+            size (int): Size in bytes of the dictionary.
+
+        Returns:
+            int: The ID of the new dictionary.
+        """
+        if not self.path:
+            raise ValueError("No path to store the dictionary in")
+
+        samples = [pickle.dumps(value, protocol=self.protocol) for value in samples]
+        dict_data = zstandard.train_dictionary(size, samples, level=self.level)
+        dict_id = dict_data.dict_id()
+
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(dict_data.as_bytes())
+        os.replace(tmp, self._dict_path(dict_id))
+
+        with self._dict_lock:
+            self._dicts[dict_id] = dict_data
+            self._dict_id = dict_id
+        return dict_id
+
+
+def sample_file_store(store, count):
+    """Yields up to `count` values picked at random from a FileStore.
+
+    Expired and unreadable entries are skipped.
+    """
+    paths = []
+    for root, dirs, files in os.walk(store._directory):
+        paths.extend(os.path.join(root, name) for name in files)
+    random.shuffle(paths)
+
+    now = time.time()
+    found = 0
+    for path in paths:
+        if found >= count:
+            return
+
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            if int(data[:10]) < now:
+                continue
+            value = store.unserialize(data[10:])
+        except Exception:
+            continue
+
+        if value is not None:
+            found += 1
+            yield value
@@ -0,0 +1,168 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class FairSemaphore(object):
+    """A semaphore that admits waiters in the order they arrived.
+
+    `threading.Semaphore` makes no ordering guarantees, so under load a
+    thread can be starved by newer arrivals. Here every waiter gets its own
+    condition in a FIFO queue and slots are handed over to the head of the
+    queue directly.
+    """
+
+    def __init__(self, value=1):
+        if value < 1:
+            raise ValueError("semaphore value must be >= 1")
+        self._value = value
+        self._lock = threading.Lock()
+        self._waiters = deque()
+
+    def acquire(self):
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return
+
+            waiter = threading.Condition(self._lock)
+            waiter.granted = False
+            self._waiters.append(waiter)
+            while not waiter.granted:
+                waiter.wait()
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                # Hand the slot over to the oldest waiter without incrementing
+                # the counter, so nobody can barge in between.
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.notify()
+            else:
+                self._value += 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class ConcurrencyLimiter(object):
+    def __init__(self, max_concurrency=1, endpoint_limits=None):
+        """Bounds the number of concurrent requests, both globally and per endpoint.
+
+        Args:
+            max_concurrency (int): Maximum number of requests in flight across
+                                   all endpoints.
+            endpoint_limits (dict): Mapping of endpoint url to the maximum
+                                    number of requests in flight against it.
+        """
+        self.max_concurrency = max_concurrency
+        self._global = FairSemaphore(max_concurrency)
+        self._endpoints = {
+            url: FairSemaphore(limit) for url, limit in (endpoint_limits or {}).items()
+        }
+
+    @contextmanager
+    def acquire(self, url):
+        """Wait for a free slot for `url`.
+
+        Yields:
+            float: Time in seconds spent waiting for the slot.
+        """
+        start_time = time.time()
+        endpoint = self._endpoints.get(url)
+
+        # Always take the endpoint slot first, so a busy endpoint doesn't
+        # hold global slots that other endpoints could use.
+        if endpoint:
+            endpoint.acquire()
+        try:
+            with self._global:
+                yield time.time() - start_time
+        finally:
+            if endpoint:
+                endpoint.release()
+
+
+class Call(object):
+    """The result of a call shared through a `SingleFlight`."""
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self._event = threading.Event()
+
+    def done(self):
+        return self._event.is_set()
+
+    def wait(self):
+        self._event.wait()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class SingleFlight(object):
+    def __init__(self):
+        """Coalesces concurrent calls sharing the same key.
+
+        The first caller for a key (the leader) does the work, everyone else
+        asking for the same key while it is in flight waits for the leader's
+        result instead of doing the work again.
+
+        Attributes:
+            coalesced (int): Number of calls that were served by another
+                             caller's result.
+        """
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def claim(self, key):
+        """Join the call in flight for `key`, or start a new one.
+
+        Returns:
+            tuple: The `Call` and whether the caller is its leader. The leader
+            must `resolve` the call once done, even if it failed.
+        """
+        with self._lock:
+            if key in self._calls:
+                self.coalesced += 1
+                return self._calls[key], False
+
+            call = self._calls[key] = Call()
+            return call, True
+
+    def resolve(self, key, call, result=None, error=None):
+        """Hand the result (or error) of a call over to everyone waiting on it."""
+        call.result = result
+        call.error = error
+        call._event.set()
+
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def do(self, key, fn):
+        """Call `fn`, unless a call for `key` is already in flight.
+
+        Returns:
+            tuple: The result and whether it was shared with another caller.
+        """
+        call, leader = self.claim(key)
+        if not leader:
+            return call.wait(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self.resolve(key, call, error=e)
+            raise
+
+        self.resolve(key, call, result)
+        return result, False
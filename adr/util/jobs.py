@@ -0,0 +1,164 @@
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+
+from loguru import logger
+
+from adr.errors import MissingDataError
+
+
+class JobHandle(object):
+    def __init__(self, url, status_url, timeout):
+        """Tracks an asynchronous ActiveData query.
+
+        Args:
+            url (str): Where the result will be available once the job is done.
+            status_url (str): Where the status of the job can be retrieved.
+            timeout (float): Time in seconds after which to give up on the job.
+        """
+        self.url = url
+        self.status_url = status_url
+        self.status = None
+        self.polls = 0
+        self.problems = 0
+        self.start_time = time.time()
+        self.deadline = self.start_time + timeout
+
+        self._error = None
+        self._event = threading.Event()
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the job to finish.
+
+        Returns:
+            str: The url of the result.
+
+        Raises:
+            MissingDataError: If the job failed or timed out.
+        """
+        if not self._event.wait(timeout):
+            raise TimeoutError(f"Job {self.status_url} is still running")
+
+        if self._error:
+            raise self._error
+        return self.url
+
+    def _finish(self, error=None):
+        self._error = error
+        self._event.set()
+
+
+class JobPoller(object):
+    MAX_PROBLEMS = 3
+
+    def __init__(self, session, initial_delay=0.5, max_delay=10, backoff=1.5, timeout=300):
+        """Polls the status of any number of ActiveData jobs from a single
+        background thread.
+
+        Jobs are polled with exponential backoff plus jitter, so short jobs
+        are noticed quickly while long ones don't get polled needlessly.
+
+        Args:
+            session (requests.Session): Session used to retrieve job status.
+            initial_delay (float): Seconds to wait before the first poll.
+            max_delay (float): Maximum number of seconds between two polls.
+            backoff (float): Factor the delay grows by after each poll.
+            timeout (float): Default number of seconds after which to give up on a job.
+        """
+        self.session = session
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def delay(self, polls):
+        """Return the time to wait before the next poll, after `polls` polls."""
+        delay = min(self.initial_delay * (self.backoff ** polls), self.max_delay)
+        # Jitter keeps jobs submitted together from being polled in lockstep.
+        return delay * random.uniform(0.5, 1.0)
+
+    def submit(self, url, status_url, timeout=None):
+        """Start polling a job.
+
+        Returns:
+            JobHandle: The handle tracking the job.
+        """
+        handle = JobHandle(url, status_url, timeout or self.timeout)
+        self._schedule(handle)
+        return handle
+
+    def _schedule(self, handle):
+        with self._cond:
+            next_poll = time.time() + self.delay(handle.polls)
+            heapq.heappush(self._heap, (next_poll, next(self._counter), handle))
+            self._cond.notify()
+
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="adr-job-poller")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Exit when idle, the thread is restarted on the next submission.
+                if not self._heap:
+                    self._thread = None
+                    return
+
+                next_poll, _, handle = self._heap[0]
+                now = time.time()
+                if next_poll > now:
+                    self._cond.wait(next_poll - now)
+                    continue
+
+                heapq.heappop(self._heap)
+
+            try:
+                if not self._poll(handle):
+                    self._schedule(handle)
+            except Exception as e:
+                handle._finish(e)
+
+    def _poll(self, handle):
+        """Poll a job once, returns True if it is finished."""
+        handle.polls += 1
+        try:
+            monitor = self.session.get(handle.status_url).json()
+        except ValueError:
+            # HAPPENS WHEN ASKING FOR status TOO SOON
+            # (DELAY BETWEEN TIME WRITTEN TO S3 AND TIME AVAILABLE FROM S3)
+            handle.problems += 1
+            if handle.problems >= self.MAX_PROBLEMS:
+                raise MissingDataError(f"Unable to retrieve status of {handle.status_url}")
+            return False
+
+        handle.problems = 0
+        handle.status = monitor['status']
+        logger.debug(f"waiting: {json.dumps(monitor)}")
+
+        if handle.status == 'done':
+            logger.debug("Job finished in {:.3f} s after {} polls".format(
+                time.time() - handle.start_time, handle.polls))
+            handle._finish()
+            return True
+        elif handle.status == 'error':
+            raise MissingDataError("Problem with query " + json.dumps(monitor['error']))
+        elif time.time() > handle.deadline:
+            raise MissingDataError(
+                "Timed out after {:.0f} seconds waiting for 'done' status".format(
+                    handle.deadline - handle.start_time))
+
+        logger.debug(f"status=\"{handle.status}\", waiting for \"done\"")
+        return False
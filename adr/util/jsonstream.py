@@ -0,0 +1,114 @@
+import codecs
+import json
+
+WHITESPACE = " \t\n\r"
+
+
+class StreamingObjectParser(object):
+    def __init__(self, chunks, key="data"):
+        """Incrementally parses a JSON object, yielding the elements of one of
+        its array members as soon as they are complete.
+
+        Only the elements of `key` are ever handed out one at a time, every
+        other member of the object is decoded whole and made available in
+        `fields`. Members are collected as they are encountered, so `fields`
+        is only complete once `rows()` has been exhausted.
+
+        Args:
+            chunks (iterable): Iterable of bytes (or str) making up the JSON document.
+            key (str): Name of the array member to stream.
+        """
+        self.key = key
+        self.fields = {}
+        self.found = False
+
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _read(self):
+        """Append the next chunk to the buffer, returns False at end of input."""
+        if self._eof:
+            return False
+
+        # Drop whatever was already consumed so the buffer doesn't grow with
+        # the size of the response.
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+        for chunk in self._chunks:
+            if isinstance(chunk, bytes):
+                chunk = self._utf8.decode(chunk)
+            if chunk:
+                self._buf += chunk
+                return True
+
+        self._buf += self._utf8.decode(b"", final=True)
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._read():
+                raise ValueError("Unexpected end of JSON input")
+
+    def _expect(self, *chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(f"Expected one of {chars} at position {self._pos}, got {char!r}")
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decode the next complete JSON value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # A value running up to the end of the buffer may be truncated
+                # (e.g a number split across two chunks), so make sure it is
+                # followed by something before trusting it.
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+
+            self._read()
+
+    def rows(self):
+        """Yield the elements of the `key` array as they are parsed."""
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            name = self._value()
+            self._expect(":")
+
+            if name == self.key and self._peek() == "[":
+                self.found = True
+                self._pos += 1
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(",", "]") == "]":
+                            break
+            else:
+                self.fields[name] = self._value()
+
+            if self._expect(",", "}") == "}":
+                return
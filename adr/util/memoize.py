@@ -1,4 +1,7 @@
 import functools
+import os
+import threading
+from collections import OrderedDict
 
 
 class memoize(dict):
@@ -45,3 +48,43 @@ class memoized_property(object):
         if not hasattr(instance, name):
             setattr(instance, name, self.func(instance))
         return getattr(instance, name)
+
+
+class memoize_file(object):
+    """A decorator to memoize the results of function calls whose first
+    argument is a path to a file.
+
+    Cached results are invalidated when the modification time or the size of
+    the file change, so edits are picked up. At most `maxsize` results are
+    kept, the least recently used ones are discarded first.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+
+    def __call__(self, func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(path, *args):
+            stat = os.stat(path)
+            key = (os.fspath(path), args)
+            version = (stat.st_mtime_ns, stat.st_size)
+
+            with lock:
+                if key in cache and cache[key][0] == version:
+                    cache.move_to_end(key)
+                    return cache[key][1]
+
+            result = func(path, *args)
+
+            with lock:
+                cache[key] = (version, result)
+                cache.move_to_end(key)
+                while len(cache) > self.maxsize:
+                    cache.popitem(last=False)
+            return result
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
@@ -1,9 +1,16 @@
+import json
+
 import requests
+import zstandard
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
 from adr.util import memoize
 
+# requests decodes gzip and deflate itself, zstd is decoded by `iter_content`.
+ACCEPT_ENCODING = "gzip, deflate, zstd"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
 
 @memoize
 def requests_retry_session(
@@ -13,6 +20,7 @@ def requests_retry_session(
     session=None,
 ):
     session = session or requests.Session()
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
     retry = Retry(
         total=retries,
         read=retries,
@@ -24,3 +32,33 @@ def requests_retry_session(
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
+
+
+def iter_content(response, chunk_size=65536):
+    """Yields the body of a response, decoding zstd compressed bodies.
+
+    Depending on its version, urllib3 may or may not have decoded the body
+    already, so it is only decompressed if it starts with a zstd frame.
+    """
+    chunks = response.iter_content(chunk_size)
+    if "zstd" not in response.headers.get("Content-Encoding", "").lower():
+        yield from chunks
+        return
+
+    decompressor = None
+    for chunk in chunks:
+        if decompressor is None:
+            if not chunk.startswith(ZSTD_MAGIC):
+                yield chunk
+                yield from chunks
+                return
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+
+
+def response_json(response):
+    """Like `response.json()`, but also supports zstd compressed bodies."""
+    return json.loads(b"".join(iter_content(response)))
@@ -0,0 +1,86 @@
+"""Compare the cost of S3Store cache hits, before and after renewals were
+made asynchronous.
+
+Runs against a local S3 stand-in, requires moto:
+
+    $ pip install moto
+    $ python extra/benchmarks/s3_store.py
+"""
+import time
+from collections import Counter
+
+import botocore
+from moto import mock_s3
+
+import adr.util.cache_stores
+from adr.util.cache_stores import S3Store
+
+BUCKET = "adr-benchmark"
+PREFIX = "data/adr_cache/"
+HITS = 500
+
+
+class LegacyS3Store(S3Store):
+    """The previous implementation, renewing items on every hit."""
+
+    def _get(self, key):
+        try:
+            head = self.client.head_object(Bucket=self._bucket, Key=self._key(key))
+            metadata = head["Metadata"]
+            metadata["id"] = "1" if "id" in metadata and metadata["id"] == "0" else "0"
+            self.client.copy_object(
+                Bucket=self._bucket,
+                CopySource={"Bucket": self._bucket, "Key": self._key(key)},
+                Key=self._key(key),
+                Metadata=metadata,
+                MetadataDirective="REPLACE",
+            )
+        except botocore.exceptions.ClientError as ex:
+            if ex.response["Error"]["Code"] == "404":
+                return None
+            raise
+
+        response = self.client.get_object(Bucket=self._bucket, Key=self._key(key))
+        return self.unserialize(response["Body"].read())
+
+
+def run(cls):
+    store = cls({"bucket": BUCKET, "prefix": PREFIX})
+    store.client.create_bucket(Bucket=BUCKET)
+
+    requests = Counter()
+    store.client.meta.events.register(
+        "before-call.s3.*", lambda model, **kwargs: requests.update([model.name])
+    )
+
+    store.put("key", {"data": list(range(1000))}, 60)
+    # Make the item old enough to be renewed, and due again every second.
+    store._renew_interval = 1
+    time.sleep(1.1)
+
+    start = time.time()
+    for _ in range(HITS):
+        store.get("key")
+    elapsed = time.time() - start
+    if hasattr(store, "wait_for_renewals"):
+        store.wait_for_renewals()
+
+    total = sum(v for k, v in requests.items() if k != "PutObject")
+    print(f"{cls.__name__}: {elapsed / HITS * 1000:.3f} ms per hit, "
+          f"{total / HITS:.2f} requests per hit ({dict(requests)})")
+
+
+def main():
+    adr.util.cache_stores.get_s3_credentials = lambda bucket, prefix: {
+        "accessKeyId": "testing",
+        "secretAccessKey": "testing",
+        "sessionToken": "testing",
+    }
+
+    for cls in (LegacyS3Store, S3Store):
+        with mock_s3():
+            run(cls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Compare compression ratio and speed of CompressedPickleSerializer settings
+on payloads shaped like ActiveData results.
+
+    $ python extra/benchmarks/serializer.py [--rows 20000]
+"""
+import argparse
+import pickle
+import random
+import time
+
+from adr.util.cache_stores import CompressedPickleSerializer
+
+PLATFORMS = ["linux64", "linux64-asan", "windows10-64", "windows7-32", "macosx1014-64", "android"]
+SUITES = ["mochitest", "reftest", "xpcshell", "web-platform-tests", "talos", "raptor", "gtest"]
+RESULTS = ["success", "testfailed", "busted", "exception", "retry"]
+
+
+def label(rng):
+    return "test-{}/{}-{}-e10s-{}".format(
+        rng.choice(PLATFORMS),
+        rng.choice(["opt", "debug", "pgo"]),
+        rng.choice(SUITES),
+        rng.randint(1, 20),
+    )
+
+
+def list_payload(rows, rng):
+    """A `list` query selecting a few task attributes."""
+    return {
+        "meta": {"format": "list"},
+        "data": [
+            {
+                "run": {"name": label(rng), "machine": {"platform": rng.choice(PLATFORMS)}},
+                "task": {"id": "%022x" % rng.getrandbits(88)},
+                "action": {"duration": rng.uniform(10, 3600)},
+                "result": rng.choice(RESULTS),
+                "repo": {"push": {"date": 1600000000 + rng.randint(0, 7 * 86400)}},
+            }
+            for _ in range(rows)
+        ],
+    }
+
+
+def table_payload(rows, rng):
+    """A `groupby` query aggregating values per label."""
+    return {
+        "meta": {"format": "table"},
+        "header": ["run.name", "count", "avg"],
+        "data": [[label(rng), rng.randint(1, 500), rng.uniform(10, 3600)] for _ in range(rows)],
+    }
+
+
+def bench(serializer, payload, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = serializer.serialize(payload)
+    encode = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        serializer.unserialize(data)
+    decode = (time.perf_counter() - start) / repeat
+    return len(data), encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    payloads = {
+        "list": list_payload(args.rows, rng),
+        "table": table_payload(args.rows, rng),
+    }
+    settings = [dict(level=level) for level in (1, 3, 6, 10, 15, 19, 22)]
+    settings.append(dict(level=10, threads=4))
+    settings.append(dict(level=19, threads=4))
+    settings.append(dict(level=10, protocol=3))
+
+    for name, payload in payloads.items():
+        size = len(pickle.dumps(payload, 5))
+        print(f"\n{name} payload: {args.rows} rows, {size / 1024:.0f} KiB pickled")
+        print(f"{'settings':<32} {'ratio':>7} {'encode ms':>10} {'decode ms':>10}")
+        for options in settings:
+            serializer = CompressedPickleSerializer(**options)
+            compressed, encode, decode = bench(serializer, payload, args.repeat)
+            label_ = ", ".join(f"{k}={v}" for k, v in options.items())
+            print(f"{label_:<32} {size / compressed:>7.1f} {encode * 1000:>10.1f} "
+                  f"{decode * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
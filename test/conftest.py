@@ -182,3 +182,19 @@ def validate():
 def responses():
     with RequestsMock() as rsps:
         yield rsps
+
+
+@pytest.fixture
+def dict_cache():
+    """Replace the configured cache with an in-memory one."""
+    config = adr.query.config
+    original = config["cache"]
+    config.update({"cache": {
+        "legacy_keys": True,
+        "retention": 1440,
+        "shard_retention": 43200,
+        "stores": {"dict": {"driver": "dict"}},
+        "default": "dict",
+    }})
+    yield config.cache
+    config.update({"cache": original})
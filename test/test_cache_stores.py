@@ -1,4 +1,7 @@
 import copy
+import datetime
+import io
+import os
 import platform
 import time
 from pathlib import Path
@@ -7,9 +10,19 @@ import boto3
 import botocore
 import pytest
 import responses
+import zstandard
+from cachy.stores import DictStore, FileStore
 
 import adr
-from adr.util.cache_stores import RenewingFileStore, S3Store, SeededFileStore
+from adr.util.cache_stores import (
+    CompressedPickleDictSerializer,
+    CompressedPickleSerializer,
+    MemoryStore,
+    RenewingFileStore,
+    S3Store,
+    SeededFileStore,
+    sample_file_store,
+)
 
 here = Path(__file__).resolve().parent
 IS_WINDOWS = "windows" in platform.system().lower()
@@ -107,12 +120,14 @@ def test_renewing_file_store(tmpdir, monkeypatch):
 def test_s3_store(monkeypatch):
     s3_data = {}
     s3_metadata = {}
+    s3_modified = {}
     copy_calls = 0
+    get_calls = 0
     get_credentials_calls = 0
     delete_calls = 0
     expire_token = False
 
-    def mock_client(t, aws_access_key_id, aws_secret_access_key, aws_session_token):
+    def mock_client(t, aws_access_key_id, aws_secret_access_key, aws_session_token, config):
         assert t == "s3"
         assert aws_access_key_id == "aws_access_key_id"
         assert aws_secret_access_key == "aws_secret_access_key"
@@ -125,33 +140,17 @@ def test_s3_store(monkeypatch):
             def read(self):
                 return self.data
 
-        class Client:
-            def head_object(self, Bucket, Key):
-                nonlocal s3_data, s3_metadata, expire_token
-                assert Bucket == "myBucket"
-                assert Key == "data/adr_cache/foo"
-
-                if expire_token:
-                    expire_token = False
-                    raise botocore.exceptions.ClientError(
-                        {"Error": {"Code": "ExpiredToken"}}, "HeadObject"
-                    )
-
-                if (Bucket, Key) in s3_data:
-                    if (Bucket, Key) in s3_metadata:
-                        return {"Metadata": copy.deepcopy(s3_metadata[(Bucket, Key)])}
-                    else:
-                        return {"Metadata": {}}
-                else:
-                    raise botocore.exceptions.ClientError(
-                        {"Error": {"Code": "404"}}, "head"
-                    )
+        def modified():
+            return datetime.datetime.fromtimestamp(time.time(), datetime.timezone.utc)
 
+        class Client:
             def put_object(self, Body, Bucket, Key):
                 nonlocal s3_data
                 assert Bucket == "myBucket"
                 assert Key == "data/adr_cache/foo"
                 s3_data[(Bucket, Key)] = Body
+                s3_metadata[(Bucket, Key)] = {}
+                s3_modified[(Bucket, Key)] = modified()
 
             def copy_object(self, Bucket, CopySource, Key, Metadata, MetadataDirective):
                 nonlocal s3_metadata, copy_calls
@@ -159,18 +158,35 @@ def test_s3_store(monkeypatch):
                 assert Key == "data/adr_cache/foo"
                 assert CopySource["Bucket"] == "myBucket"
                 assert CopySource["Key"] == "data/adr_cache/foo"
-                if (Bucket, Key) in s3_metadata:
-                    assert Metadata != s3_metadata[(Bucket, Key)]
+                assert Metadata != s3_metadata[(Bucket, Key)]
                 assert MetadataDirective == "REPLACE"
                 s3_metadata[(Bucket, Key)] = copy.deepcopy(Metadata)
+                s3_modified[(Bucket, Key)] = modified()
 
                 copy_calls += 1
 
             def get_object(self, Bucket, Key):
-                nonlocal s3_data
+                nonlocal s3_data, expire_token, get_calls
                 assert Bucket == "myBucket"
                 assert Key == "data/adr_cache/foo"
-                return {"Body": Response(s3_data[(Bucket, Key)])}
+                get_calls += 1
+
+                if expire_token:
+                    expire_token = False
+                    raise botocore.exceptions.ClientError(
+                        {"Error": {"Code": "ExpiredToken"}}, "GetObject"
+                    )
+
+                if (Bucket, Key) not in s3_data:
+                    raise botocore.exceptions.ClientError(
+                        {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+                    )
+
+                return {
+                    "Body": Response(s3_data[(Bucket, Key)]),
+                    "LastModified": s3_modified[(Bucket, Key)],
+                    "Metadata": copy.deepcopy(s3_metadata[(Bucket, Key)]),
+                }
 
             def delete_object(self, Bucket, Key):
                 nonlocal delete_calls
@@ -207,6 +223,7 @@ def test_s3_store(monkeypatch):
     config = {
         "bucket": "myBucket",
         "prefix": "data/adr_cache/",
+        "renew_interval": 60,
     }
     fs = S3Store(config)
 
@@ -216,23 +233,36 @@ def test_s3_store(monkeypatch):
     assert fs.get("foo") is None
     assert get_credentials_calls == 1
 
-    # Store an element in the cache.
+    # Store an element in the cache, fresh items aren't renewed.
     fs.put("foo", "bar", 1)
     assert fs.get("foo") == "bar"
-    assert copy_calls == 1
+    assert get_calls == 2
+    fs.wait_for_renewals()
+    assert copy_calls == 0
     assert get_credentials_calls == 1
 
-    # Ensure we update the metadata to renew the item expiration.
+    # Ensure we update the metadata to renew the item expiration once the
+    # renewal interval passed, but only once per interval.
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61 * 60)
     assert fs.get("foo") == "bar"
-    assert copy_calls == 2
-    assert get_credentials_calls == 1
+    assert fs.get("foo") == "bar"
+    assert get_calls == 4
+    fs.wait_for_renewals()
+    assert copy_calls == 1
 
     # Re-request AWS credentials if they expired.
     expire_token = True
     assert fs.get("foo") == "bar"
-    assert copy_calls == 3
     assert get_credentials_calls == 2
 
+    # Items renewed elsewhere aren't renewed again.
+    fs2 = S3Store(config)
+    monkeypatch.setattr(time, "time", lambda: now + 90 * 60)
+    assert fs2.get("foo") == "bar"
+    fs2.wait_for_renewals()
+    assert copy_calls == 1
+
     # Delete object if the stored data is broken.
     s3_data[("myBucket", "data/adr_cache/foo")] = "goo"
     assert fs.get("foo") is None
@@ -241,10 +271,167 @@ def test_s3_store(monkeypatch):
     # Store an element in the cache.
     fs.put("foo", "bar", 1)
     assert fs.get("foo") == "bar"
-    assert copy_calls == 5
-    assert get_credentials_calls == 2
 
     # Forget an element.
     fs.forget("foo")
     assert delete_calls == 2
     assert fs.get("foo") is None
+
+
+def test_s3_store_bulk(monkeypatch):
+    s3_data = {}
+    delete_batches = []
+
+    class Client:
+        def get_object(self, Bucket, Key):
+            if Key not in s3_data:
+                raise botocore.exceptions.ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+            return {
+                "Body": io.BytesIO(s3_data[Key]),
+                "LastModified": datetime.datetime.now(datetime.timezone.utc),
+                "Metadata": {},
+            }
+
+        def put_object(self, Body, Bucket, Key):
+            s3_data[Key] = Body
+
+        def delete_objects(self, Bucket, Delete):
+            assert Delete["Quiet"]
+            delete_batches.append(len(Delete["Objects"]))
+            for obj in Delete["Objects"]:
+                del s3_data[obj["Key"]]
+            return {}
+
+    def mock_client(t, config, **kwargs):
+        assert config.max_pool_connections == 8
+        return Client()
+
+    monkeypatch.setattr(boto3, "client", mock_client)
+    monkeypatch.setattr(adr.util.cache_stores, "get_s3_credentials", lambda bucket, prefix: {
+        "accessKeyId": "", "secretAccessKey": "", "sessionToken": "",
+    })
+
+    fs = S3Store({"bucket": "myBucket", "prefix": "cache/", "max_connections": 8})
+    items = {f"key{i}": i for i in range(2500)}
+    fs.put_many(items, 1)
+    assert len(s3_data) == 2500
+
+    assert fs.get_many(["key1", "key2", "missing"]) == {"key1": 1, "key2": 2, "missing": None}
+
+    store = MemoryStore(fs, max_size=1024 * 1024)
+    assert store.get_many(["key3"]) == {"key3": 3}
+    del s3_data["cache/key3"]
+    assert store.get_many(["key3", "key4"]) == {"key3": 3, "key4": 4}
+
+    store.forget_many(["key4"])
+    assert "key4" not in store._entries
+    fs.forget_many(k for k in items if k not in ("key3", "key4"))
+    assert s3_data == {}
+    assert sorted(delete_batches) == [1, 498, 1000, 1000]
+
+
+def test_memory_store(monkeypatch):
+    backing = DictStore()
+    store = MemoryStore(backing, max_size=200, ttl=10)
+
+    store.put("foo", {"data": [1, 2, 3]}, 5)
+    assert backing.get("foo") == {"data": [1, 2, 3]}
+
+    # Every hit is a copy.
+    value = store.get("foo")
+    value["data"].append(4)
+    assert store.get("foo") == {"data": [1, 2, 3]}
+
+    # Read through to the backing store.
+    backing.put("bar", "x" * 50, 5)
+    assert store.get("bar") == "x" * 50
+    backing.forget("bar")
+    assert store.get("bar") == "x" * 50
+
+    # Least recently used values are evicted first.
+    store.get("foo")
+    store.put("baz", "y" * 100, 5)
+    assert "bar" not in store._entries
+    assert list(store._entries) == ["foo", "baz"]
+    assert store.size <= 200
+
+    # Values too large for memory only go to the backing store.
+    store.put("big", "z" * 300, 5)
+    assert "big" not in store._entries
+    assert store.get("big") == "z" * 300
+
+    # Values expire from memory.
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 6 * 60)
+    backing.forget("foo")
+    assert store.get("foo") is None
+
+    store.forget("baz")
+    assert store.get("baz") is None
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"level": 1, "threads": 2},
+    {"min_size": 0},
+    {"min_size": 10 ** 6},
+    {"protocol": 2},
+])
+def test_compressed_pickle_serializer(options):
+    value = {"data": [["test-linux64/opt-mochitest-{}".format(i), i] for i in range(1000)]}
+    serializer = CompressedPickleSerializer(**options)
+    data = serializer.serialize(value)
+
+    compressed = data[:4] == CompressedPickleSerializer.ZSTD_MAGIC
+    assert compressed == (options.get("min_size", 512) < 10 ** 6)
+
+    # Entries can be read whatever the settings they were written with.
+    for other in (CompressedPickleSerializer(), CompressedPickleSerializer(level=22)):
+        assert other.unserialize(data) == value
+    assert serializer.unserialize(memoryview(data)) == value
+
+
+def make_result(i):
+    return {
+        "meta": {"format": "table", "timing": {"total": i / 10}},
+        "header": ["run.name", "count", "avg"],
+        "data": [["test-linux64/opt-mochitest-{}".format(j), i * j, j / 3] for j in range(20)],
+    }
+
+
+def test_compressed_pickle_dict_serializer(tmpdir):
+    path = tmpdir.join("dicts").strpath
+    serializer = CompressedPickleDictSerializer(path, min_size=0)
+    assert serializer.dict_id == 0
+
+    # Without a dictionary, this is a plain CompressedPickleSerializer.
+    plain = serializer.serialize(make_result(0))
+    assert zstandard.get_frame_parameters(plain).dict_id == 0
+
+    dict_id = serializer.train([make_result(i) for i in range(500)], size=4096)
+    assert serializer.dict_id == dict_id
+    assert (tmpdir / "dicts" / f"{dict_id}.zdict").isfile()
+
+    data = serializer.serialize(make_result(1000))
+    assert zstandard.get_frame_parameters(data).dict_id == dict_id
+    assert len(data) < len(CompressedPickleSerializer(min_size=0).serialize(make_result(1000)))
+
+    # Another process picks up the dictionary from disk.
+    other = CompressedPickleDictSerializer(path)
+    assert other.dict_id == dict_id
+    assert other.unserialize(data) == make_result(1000)
+    assert other.unserialize(plain) == make_result(0)
+
+    # Entries written with a dictionary that is gone are missing.
+    os.remove(os.path.join(path, f"{dict_id}.zdict"))
+    assert CompressedPickleDictSerializer(path).unserialize(data) is None
+
+
+def test_sample_file_store(tmpdir):
+    store = FileStore(tmpdir.strpath)
+    for i in range(10):
+        store.put(f"key{i}", i, 1)
+    store.put("expired", -1, -1)
+
+    assert sorted(sample_file_store(store, 100)) == list(range(10))
+    assert len(list(sample_file_store(store, 3))) == 3
@@ -0,0 +1,46 @@
+import pytest
+
+from adr import compact
+
+
+def test_compact_query():
+    query = {
+        "from": "task",
+        "select": ["run.name", {"name": "duration", "value": "action.duration"}],
+    }
+    assert compact.compact_query(query) == dict(query, format="table")
+    assert compact.compact_query(dict(query, format="list")) == dict(query, format="table")
+
+
+@pytest.mark.parametrize("extra", [
+    {"format": "table"},
+    {"groupby": ["run.name"]},
+    {"select": "*"},
+    {"select": ["run.*"]},
+    {"select": {"aggregate": "count"}},
+    {"select": [{"value": {"div": ["action.duration", 60]}}]},
+])
+def test_compact_query_unsupported(extra):
+    query = {"from": "task", "select": ["run.name"]}
+    query.update(extra)
+    assert compact.compact_query(query) is None
+
+
+def test_expand_result():
+    query = {"select": ["run.name", "run.state", {"name": "duration", "value": "action.duration"}]}
+    result = {
+        "header": ["run.name", "run.state", "duration"],
+        "data": [["a", "completed", 1.5], ["b", None, 2]],
+        "meta": {"format": "table"},
+    }
+    assert compact.expand_result(query, result) == {
+        "data": [
+            {"run": {"name": "a", "state": "completed"}, "duration": 1.5},
+            {"run": {"name": "b"}, "duration": 2},
+        ],
+        "meta": {"format": "list"},
+    }
+
+    query = {"select": "run.name"}
+    result = {"header": ["run.name"], "data": [["a"], ["b"]]}
+    assert compact.expand_result(query, result) == {"data": ["a", "b"]}
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from adr.util.concurrency import ConcurrencyLimiter, FairSemaphore, SingleFlight
+
+
+def test_fair_semaphore_is_fifo():
+    sem = FairSemaphore(1)
+    sem.acquire()
+
+    order = []
+
+    def worker(i):
+        with sem:
+            order.append(i)
+
+    threads = []
+    for i in range(5):
+        t = threading.Thread(target=worker, args=(i,))
+        t.start()
+        threads.append(t)
+        # Make sure each thread is queued before starting the next one.
+        while len(sem._waiters) <= i:
+            time.sleep(0.001)
+
+    sem.release()
+    for t in threads:
+        t.join()
+
+    assert order == [0, 1, 2, 3, 4]
+
+
+def test_concurrency_limiter():
+    limiter = ConcurrencyLimiter(3, {"https://slow": 1})
+    lock = threading.Lock()
+    running = {"https://slow": 0, "https://fast": 0}
+    peak = {"https://slow": 0, "https://fast": 0}
+
+    def worker(url):
+        with limiter.acquire(url) as wait_time:
+            assert wait_time >= 0
+            with lock:
+                running[url] += 1
+                peak[url] = max(peak[url], running[url])
+                assert sum(running.values()) <= 3
+            time.sleep(0.01)
+            with lock:
+                running[url] -= 1
+
+    threads = [
+        threading.Thread(target=worker, args=(url,))
+        for url in ["https://slow", "https://fast"] * 5
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert peak["https://slow"] == 1
+    assert peak["https://fast"] > 1
+
+
+def test_single_flight():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "result"
+
+    results = []
+
+    def worker():
+        results.append(flight.do("key", work))
+
+    leader = threading.Thread(target=worker)
+    leader.start()
+    started.wait()
+
+    followers = [threading.Thread(target=worker) for _ in range(3)]
+    for t in followers:
+        t.start()
+    while flight.coalesced < 3:
+        time.sleep(0.001)
+
+    release.set()
+    for t in [leader] + followers:
+        t.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [("result", False)] + [("result", True)] * 3
+
+    # Once finished, the next call runs again.
+    assert flight.do("key", lambda: "other") == ("other", False)
+
+
+def test_single_flight_error():
+    flight = SingleFlight()
+    call, leader = flight.claim("key")
+    assert leader
+
+    joined, leader = flight.claim("key")
+    assert joined is call
+    assert not leader
+
+    flight.resolve("key", call, error=ValueError("oops"))
+    with pytest.raises(ValueError):
+        joined.wait()
@@ -7,11 +7,13 @@ import pytest
 from appdirs import user_config_dir
 from tomlkit import dumps
 
+from adr import cli
 from adr.configuration import (
     Configuration,
     CustomCacheManager,
     merge_to,
 )
+from adr.util.cache_stores import MemoryStore
 
 here = Path(__file__).parent.resolve()
 
@@ -114,3 +116,79 @@ def test_custom_serializer(tmpdir, create_config):
     with concurrent.futures.ThreadPoolExecutor() as executor:
         f = executor.submit(lambda: config.cache.get('foo') == set(['bar']))
         assert f.result() is True
+
+
+def test_memory_cache(tmpdir, create_config):
+    path = tmpdir.mkdir("cache")
+    config = create_config(
+        {
+            "cache": {
+                "memory": {"max_size": 1},
+                "stores": {"file": {"driver": "file", "path": path.strpath}},
+                "default": "file"
+            }
+        }
+    )
+
+    store = config.cache.store().get_store()
+    assert isinstance(store, MemoryStore)
+    assert store.ttl == 10
+
+    config.cache.put('foo', ['bar'], 1)
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        f = executor.submit(lambda: config.cache.store().get_store())
+        assert f.result() is store
+
+    # Served from memory, even once gone from the backing store.
+    store.store.forget('foo')
+    assert config.cache.get('foo') == ['bar']
+
+
+def test_compression_config(tmpdir, create_config):
+    path = tmpdir.mkdir("cache")
+    config = create_config(
+        {
+            "cache": {
+                "serializer": "compressedpickle",
+                "compression": {"level": 3, "min_size": 0},
+                "stores": {"file": {"driver": "file", "path": path.strpath}},
+                "default": "file"
+            }
+        }
+    )
+
+    serializer = config.cache.store().get_store()._serializer
+    assert serializer.level == 3
+    assert serializer.min_size == 0
+    assert serializer.threads == 0
+
+    config.cache.put('foo', ['bar'], 1)
+    assert config.cache.get('foo') == ['bar']
+
+
+def test_cache_train_dict(tmpdir, create_config, monkeypatch):
+    path = tmpdir.mkdir("cache")
+    config = create_config(
+        {
+            "cache": {
+                "serializer": "compressedpickle-dict",
+                "stores": {"file": {"driver": "file", "path": path.strpath}},
+                "default": "file"
+            }
+        }
+    )
+    for i in range(300):
+        config.cache.put(f"key{i}", {"header": ["run.name", "count"], "data": [[f"t{i}", i]]}, 1)
+
+    monkeypatch.setattr(cli, "config", config)
+    config.merge({"dict_samples": 1000, "dict_size": 2048})
+    message = cli.handle_cache_train_dict([])
+
+    serializer = config.cache.store().get_store()._serializer
+    assert serializer.dict_id
+    assert serializer.path == path.strpath + "-dicts"
+    assert str(serializer.dict_id) in message
+
+    config.cache.put("new", {"data": [1]}, 1)
+    assert config.cache.get("new") == {"data": [1]}
+    assert config.cache.get("key1") == {"header": ["run.name", "count"], "data": [["t1", 1]]}
@@ -59,3 +59,18 @@ DEFINITIONS = [
 
 def id_fn(val):
     return str(val)
+
+
+def _batched_recipe(args):
+    foo = run_query('foo', args)  # noqa
+    bar, baz = run_queries([('bar', args), ('baz', args)])  # noqa
+    return args.table
+
+
+def test_extract_arguments():
+    calls, attrs = context.extract_arguments(_batched_recipe, ("run_query", "run_queries"))
+    assert calls == {"foo", "bar", "baz"}
+    assert attrs == {"table"}
+
+    calls, attrs = context.extract_arguments(_batched_recipe, "run_query")
+    assert calls == {"foo"}
@@ -0,0 +1,61 @@
+import pytest
+
+from adr.errors import MissingDataError
+from adr.util.jobs import JobPoller
+
+
+class MockResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        if isinstance(self.data, Exception):
+            raise self.data
+        return self.data
+
+
+class MockSession:
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = {}
+
+    def get(self, url):
+        self.calls[url] = self.calls.get(url, 0) + 1
+        statuses = self.statuses[url]
+        return MockResponse(statuses.pop(0) if len(statuses) > 1 else statuses[0])
+
+
+def test_job_poller():
+    session = MockSession({
+        "short": [{"status": "done"}],
+        "long": [ValueError("too soon"), {"status": "running"}, {"status": "done"}],
+        "broken": [{"status": "error", "error": "oops"}],
+        "forever": [{"status": "running"}],
+    })
+    poller = JobPoller(session, initial_delay=0.001, max_delay=0.01, timeout=0.2)
+
+    short = poller.submit("short_url", "short")
+    long = poller.submit("long_url", "long")
+    broken = poller.submit("broken_url", "broken")
+    forever = poller.submit("forever_url", "forever")
+
+    assert short.result(timeout=5) == "short_url"
+    assert long.result(timeout=5) == "long_url"
+    assert long.polls == 3
+
+    with pytest.raises(MissingDataError, match="Problem with query"):
+        broken.result(timeout=5)
+
+    with pytest.raises(MissingDataError, match="Timed out"):
+        forever.result(timeout=5)
+
+    # Delays are capped by max_delay, so the job was polled many times.
+    assert session.calls["forever"] >= 10
+    assert session.calls["short"] == 1
+
+
+def test_job_poller_backoff():
+    poller = JobPoller(None, initial_delay=1, max_delay=10, backoff=2)
+    for polls, maximum in [(0, 1), (1, 2), (2, 4), (3, 8), (4, 10), (10, 10)]:
+        delay = poller.delay(polls)
+        assert maximum / 2 <= delay <= maximum
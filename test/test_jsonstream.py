@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from adr.util.jsonstream import StreamingObjectParser
+
+
+def chunked(obj, size):
+    data = json.dumps(obj).encode("utf-8")
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1024])
+def test_streaming_object_parser(size):
+    obj = {
+        "meta": {"format": "list"},
+        "data": [{"name": "é", "count": 12345}, 6789, None, [1.5, "]"], "}"],
+        "header": ["name", "count"],
+    }
+    parser = StreamingObjectParser(chunked(obj, size))
+    assert list(parser.rows()) == obj["data"]
+    assert parser.found
+    assert parser.fields == {"meta": obj["meta"], "header": obj["header"]}
+
+
+def test_streaming_object_parser_missing_key():
+    parser = StreamingObjectParser(chunked({"url": "foo", "status": "bar"}, 4))
+    assert list(parser.rows()) == []
+    assert not parser.found
+    assert parser.fields == {"url": "foo", "status": "bar"}
+
+    parser = StreamingObjectParser(chunked({"data": []}, 4))
+    assert list(parser.rows()) == []
+    assert parser.found
+
+
+def test_streaming_object_parser_truncated():
+    parser = StreamingObjectParser(chunked({"data": [1, 2, 3]}, 4)[:-1])
+    with pytest.raises(ValueError):
+        list(parser.rows())
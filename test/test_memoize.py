@@ -0,0 +1,42 @@
+import os
+
+from adr.util import memoize_file
+
+
+def test_memoize_file(tmpdir):
+    calls = []
+
+    @memoize_file(maxsize=2)
+    def read(path, suffix=""):
+        calls.append(path)
+        with open(path) as fh:
+            return fh.read() + suffix
+
+    foo = tmpdir.join("foo")
+    foo.write("foo")
+    bar = tmpdir.join("bar")
+    bar.write("bar")
+    baz = tmpdir.join("baz")
+    baz.write("baz")
+
+    assert read(foo.strpath) == "foo"
+    assert read(foo.strpath) == "foo"
+    assert read(foo.strpath, "!") == "foo!"
+    assert len(calls) == 2
+
+    # Modifying the file invalidates the cached result.
+    foo.write("fooo")
+    assert read(foo.strpath) == "fooo"
+    assert len(calls) == 3
+
+    stat = os.stat(foo.strpath)
+    foo.write("oooo")
+    os.utime(foo.strpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert read(foo.strpath) == "oooo"
+    assert len(calls) == 4
+
+    # Only the two most recently used results are kept.
+    assert read(bar.strpath) == "bar"
+    assert read(baz.strpath) == "baz"
+    assert read(foo.strpath) == "oooo"
+    assert len(calls) == 7
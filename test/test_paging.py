@@ -0,0 +1,55 @@
+from adr import paging
+
+
+def test_is_pageable():
+    query = {"from": "task", "groupby": ["run.name"], "limit": 10000}
+    assert paging.is_pageable(query, 1000)
+    assert not paging.is_pageable(query, 0)
+    assert not paging.is_pageable(query, 10000)
+    assert not paging.is_pageable(dict(query, sort="count"), 1000)
+    assert not paging.is_pageable(dict(query, format="cube"), 1000)
+    assert not paging.is_pageable(dict(query, groupby=None), 1000)
+    assert not paging.is_pageable(dict(query, groupby=[{"value": {"div": ["a", 2]}}]), 1000)
+
+
+def test_page_query():
+    query = {
+        "from": "task",
+        "groupby": ["run.name", {"name": "platform", "value": "run.machine.platform"}],
+        "where": {"eq": {"repo.branch.name": "autoland"}},
+        "limit": 250,
+    }
+    first = paging.page_query(query, 100)
+    assert first == dict(query, limit=100, sort=["run.name", "run.machine.platform"])
+
+    page = paging.page_query(query, 100, 200, ("test-linux", "linux64"))
+    assert page["limit"] == 50
+    assert page["where"] == {"and": [
+        {"eq": {"repo.branch.name": "autoland"}},
+        {"or": [
+            {"gt": {"run.name": "test-linux"}},
+            {"and": [
+                {"eq": {"run.name": "test-linux"}},
+                {"gt": {"run.machine.platform": "linux64"}},
+            ]},
+        ]},
+    ]}
+
+    # Nulls sort last.
+    page = paging.page_query(query, 100, 100, ("test-linux", None))
+    assert page["where"]["and"][1] == {"gt": {"run.name": "test-linux"}}
+    assert paging.page_query(query, 100, 100, (None, None)) is None
+    assert paging.page_query(query, 100, 250, ("test-linux", "linux64")) is None
+
+
+def test_last_key():
+    query = {"groupby": ["run.name", {"name": "platform", "value": "run.machine.platform"}]}
+    result = {
+        "header": ["platform", "run.name", "count"],
+        "data": [["win", "a", 1], ["mac", "b", 2]],
+    }
+    assert paging.last_key(query, result) == ("b", "mac")
+
+    result = {"data": [{"run": {"name": "a"}, "platform": "win", "count": 1}]}
+    assert paging.last_key(query, result) == ("a", "win")
+    assert paging.last_key(query, {"data": []}) is None
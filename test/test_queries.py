@@ -1,8 +1,12 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import json
+import threading
+import time
+from argparse import Namespace
 from io import StringIO as IO
 
+import pytest
 import yaml
 
 from adr import config
@@ -79,3 +83,275 @@ def test_query(monkeypatch, query_test, set_config):
         print_diff()
         assert result == query_test["expected"]
         assert debug_url is None
+
+
+def test_run_queries(monkeypatch):
+    calls = []
+
+    def mock_query_activedata(query_str, url):
+        query = json.loads(query_str)
+        calls.append(query)
+        return {"data": [query["from"]]}
+
+    monkeypatch.setattr(query, 'query_activedata', mock_query_activedata)
+
+    results = query.run_queries([
+        ('meta_columns', Namespace(table='task')),
+        ('meta', Namespace()),
+        ('meta_columns', Namespace(table='unittest')),
+        ('meta_columns', Namespace(table='task')),
+    ])
+    assert [r["data"] for r in results] == [
+        ["meta.columns"],
+        ["meta.columns"],
+        ["meta.columns"],
+        ["meta.columns"],
+    ]
+    assert results[0] == results[3]
+    assert results[0] is not results[3]
+
+    # The duplicate query only ran once.
+    assert len(calls) == 3
+    assert sorted(str(c.get("where")) for c in calls) == [
+        "None",
+        "{'eq': {'table': 'task'}}",
+        "{'eq': {'table': 'unittest'}}",
+    ]
+
+
+def test_stream_query(monkeypatch, dict_cache):
+    calls = []
+    data = [{"name": f"column{i}"} for i in range(25)]
+
+    def mock_stream_activedata(query_str, url):
+        calls.append(query_str)
+        body = json.dumps({"data": data, "meta": {"format": "list"}}).encode("utf-8")
+        for i in range(0, len(body), 16):
+            yield body[i:i + 16]
+
+    monkeypatch.setattr(query, 'stream_activedata', mock_stream_activedata)
+
+    args = Namespace(table='task')
+    assert list(query.stream_query('meta_columns', args, chunk_size=10)) == data
+    assert len(calls) == 1
+
+    # The second run is served from the cache.
+    assert list(query.stream_query('meta_columns', args, chunk_size=10)) == data
+    assert len(calls) == 1
+
+    # Losing a chunk re-runs the query, without yielding rows twice.
+    key = query.prepare_query('meta_columns', args).key
+    dict_cache.forget(f"{key}.stream.1")
+    assert list(query.stream_query('meta_columns', args, chunk_size=10)) == data
+    assert len(calls) == 2
+
+
+def test_canonicalize_query():
+    a = {
+        "from": "task",
+        "where": {"and": [
+            {"eq": {"build.type": "opt"}},
+            {"or": [{"eq": {"x": 2}}, {"eq": {"x": 1}}]},
+        ]},
+        "select": ["b", "a"],
+    }
+    b = {
+        "select": ["b", "a"],
+        "where": {"and": [
+            {"or": [{"eq": {"x": 1}}, {"eq": {"x": 2}}]},
+            {"eq": {"build.type": "opt"}},
+        ]},
+        "from": "task",
+    }
+    assert query.canonicalize_query(a) == query.canonicalize_query(b)
+    assert query.query_digest(query.canonicalize_query(a)) == \
+        query.query_digest(query.canonicalize_query(b))
+
+    # Order matters outside of commutative operators.
+    c = dict(b, select=["a", "b"])
+    assert query.query_digest(query.canonicalize_query(a)) != \
+        query.query_digest(query.canonicalize_query(c))
+
+    # The input is left untouched.
+    assert a["where"]["and"][0] == {"eq": {"build.type": "opt"}}
+
+
+def test_prepare_query_all(monkeypatch):
+    prepared = query.prepare_query('meta_columns', Namespace(table='all'))
+    assert json.loads(prepared.query_str)["where"] == {"eq": {"table": None}}
+
+
+def test_legacy_cache_key(monkeypatch, dict_cache):
+    monkeypatch.setattr(query, 'query_activedata', lambda *args: pytest.fail("not cached"))
+
+    args = Namespace(table='task')
+    prepared = query.prepare_query('meta_columns', args)
+    assert prepared.legacy_key != prepared.key
+    dict_cache.put(prepared.legacy_key, {"data": ["legacy"]}, 1)
+
+    assert query.run_query('meta_columns', args) == {"data": ["legacy"]}
+    assert dict_cache.get(prepared.key) == {"data": ["legacy"]}
+    assert dict_cache.get(prepared.legacy_key) is None
+
+
+def test_run_query_coalesced(monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def mock_query_activedata(query_str, url):
+        calls.append(query_str)
+        release.wait()
+        return {"data": [1, 2, 3]}
+
+    monkeypatch.setattr(query, 'query_activedata', mock_query_activedata)
+
+    results = []
+    args = Namespace(table='task')
+    coalesced = query.inflight.coalesced
+    threads = [
+        threading.Thread(target=lambda: results.append(query.run_query('meta_columns', args)))
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    while query.inflight.coalesced < coalesced + 3:
+        time.sleep(0.001)
+
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == [{"data": [1, 2, 3]}] * 4
+
+
+def test_stale_while_revalidate(monkeypatch, dict_cache):
+    monkeypatch.setitem(query.config["cache"], "max_staleness", 60)
+    monkeypatch.setattr(query, 'query_activedata', lambda *args: {"data": ["fresh"]})
+
+    args = Namespace(table='task')
+    prepared = query.prepare_query('meta_columns', args)
+
+    # Fresh entries are returned without refreshing them.
+    dict_cache.put(prepared.key, query.CacheEntry({"data": ["cached"]}, time.time() + 60), 2)
+    assert query.run_query('meta_columns', args) == {"data": ["cached"]}
+    assert dict_cache.get(prepared.key).value == {"data": ["cached"]}
+
+    # Stale entries are returned right away and refreshed in the background.
+    dict_cache.put(prepared.key, query.CacheEntry({"data": ["stale"]}, time.time() - 1), 1)
+    assert query.run_query('meta_columns', args) == {"data": ["stale"]}
+
+    for _ in range(1000):
+        entry = dict_cache.get(prepared.key)
+        if entry.value == {"data": ["fresh"]}:
+            break
+        time.sleep(0.005)
+    assert entry.value == {"data": ["fresh"]}
+    assert not entry.is_stale()
+    assert query.run_query('meta_columns', args) == {"data": ["fresh"]}
+
+
+def test_run_query_sharded(monkeypatch, dict_cache):
+    day = 86400
+    start = 1583712000  # 2020-03-09 UTC
+    rows = [{"date": start + i * day / 2} for i in range(20)]
+    calls = []
+
+    def mock_query_activedata(query_str, url):
+        where = json.loads(query_str)["where"]["and"]
+        calls.append(where)
+        bounds = {op: value["date"] for clause in where for op, value in clause.items()}
+        return {"data": [r for r in rows if bounds["gte"] <= r["date"] < bounds["lt"]]}
+
+    monkeypatch.setitem(query.config["cache"], "shard", "day")
+    monkeypatch.setattr(query, 'query_activedata', mock_query_activedata)
+    monkeypatch.setattr(query, '_load_query_template', lambda path: query.CompiledTemplate({
+        "from": "task",
+        "limit": 100,
+        "where": {"and": [
+            {"gte": {"date": {"$eval": "start"}}},
+            {"lt": {"date": {"$eval": "end"}}},
+        ]},
+    }))
+
+    result = query.run_query('meta_columns', Namespace(start=start, end=start + 3 * day))
+    assert result == {"data": rows[:6]}
+    assert len(calls) == 3
+
+    # Moving the range only fetches the missing day.
+    result = query.run_query('meta_columns', Namespace(start=start + day, end=start + 4 * day))
+    assert result == {"data": rows[2:8]}
+    assert len(calls) == 4
+
+    results = query.run_queries([
+        ('meta_columns', Namespace(start=start, end=start + 2 * day)),
+        ('meta_columns', Namespace(start=start + 8 * day, end=start + 10 * day)),
+    ])
+    assert results == [{"data": rows[:4]}, {"data": rows[16:]}]
+    assert len(calls) == 6
+
+    # Empty shards are fine, as long as there is some data overall.
+    with pytest.raises(query.MissingDataError):
+        query.run_query('meta_columns', Namespace(start=start + 20 * day, end=start + 22 * day))
+
+
+def test_run_query_paged(monkeypatch, dict_cache):
+    rows = [["label-{:02d}".format(i), i] for i in range(25)]
+    calls = []
+    failures = [1]
+
+    def mock_query_activedata(query_str, url):
+        q = json.loads(query_str)
+        calls.append(q)
+        assert q["sort"] == ["run.name"]
+        data = rows
+        if "where" in q:
+            if failures:
+                failures.pop()
+                raise query.MissingDataError("oops")
+            data = [r for r in rows if r[0] > q["where"]["gt"]["run.name"]]
+        return {"header": ["run.name", "count"], "data": data[:q["limit"]]}
+
+    monkeypatch.setitem(query.config["activedata"], "page_size", 10)
+    monkeypatch.setattr(query, 'query_activedata', mock_query_activedata)
+    monkeypatch.setattr(query, '_load_query_template', lambda path: query.CompiledTemplate({
+        "from": "task",
+        "groupby": ["run.name"],
+        "limit": {"$eval": "limit"},
+    }))
+
+    args = Namespace(limit=100)
+    result = query.run_query('meta_columns', args)
+    assert result == {"header": ["run.name", "count"], "data": rows}
+    # Three pages, the second of which failed once.
+    assert [q["limit"] for q in calls] == [10, 10, 10, 10]
+
+    assert list(query.paginate_query('meta_columns', args)) == rows
+    assert len(calls) == 4
+
+    assert list(query.paginate_query('meta_columns', Namespace(limit=15))) == rows[:15]
+    assert [q["limit"] for q in calls[4:]] == [5]
+
+
+def test_run_query_compact_format(monkeypatch, dict_cache):
+    sent = []
+
+    def mock_query_activedata(query_str, url):
+        sent.append(json.loads(query_str))
+        return {"header": ["run.name"], "data": [["a"], ["b"]], "meta": {"format": "table"}}
+
+    monkeypatch.setitem(query.config["activedata"], "compact_format", True)
+    monkeypatch.setattr(query, 'query_activedata', mock_query_activedata)
+    monkeypatch.setattr(query, '_load_query_template', lambda path: query.CompiledTemplate({
+        "from": "task",
+        "select": ["run.name"],
+        "format": "list",
+    }))
+
+    result = query.run_query('meta_columns', Namespace())
+    assert sent[0]["format"] == "table"
+    assert result == {"data": [{"run": {"name": "a"}}, {"run": {"name": "b"}}],
+                      "meta": {"format": "list"}}
+    # Results are cached in the format the query asked for.
+    assert query.run_query('meta_columns', Namespace()) == result
+    assert len(sent) == 1
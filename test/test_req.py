@@ -0,0 +1,24 @@
+import json
+
+import responses
+import zstandard
+
+from adr.util.req import ACCEPT_ENCODING, requests_retry_session, response_json
+
+
+@responses.activate
+def test_response_json_zstd():
+    body = json.dumps({"data": [1, 2, 3]}).encode("utf-8")
+    responses.add(
+        responses.GET,
+        "https://example.com/zstd",
+        body=zstandard.ZstdCompressor().compress(body),
+        headers={"Content-Encoding": "zstd"},
+    )
+    responses.add(responses.GET, "https://example.com/plain", body=body)
+
+    session = requests_retry_session()
+    response = session.get("https://example.com/zstd")
+    assert response.request.headers["Accept-Encoding"] == ACCEPT_ENCODING
+    assert response_json(response) == {"data": [1, 2, 3]}
+    assert response_json(session.get("https://example.com/plain")) == {"data": [1, 2, 3]}
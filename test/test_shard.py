@@ -0,0 +1,122 @@
+import calendar
+import datetime
+
+import pytest
+
+from adr import shard
+
+# 2020-03-10 15:30:00 UTC
+NOW = calendar.timegm((2020, 3, 10, 15, 30, 0))
+DAY = 86400
+TODAY = calendar.timegm((2020, 3, 10, 0, 0, 0))
+
+
+@pytest.mark.parametrize("value,expected", [
+    (1583800000, 1583800000),
+    ("2020-03-01", calendar.timegm((2020, 3, 1, 0, 0, 0))),
+    ("now", NOW),
+    ("today", TODAY),
+    ("eod", TODAY + DAY),
+    ("today-week", TODAY - 7 * DAY),
+    ("today-2day", TODAY - 2 * DAY),
+    ("now-3hours", NOW - 3 * 3600),
+    ("today-month", calendar.timegm((2020, 2, 10, 0, 0, 0))),
+    ("today - year", calendar.timegm((2019, 3, 10, 0, 0, 0))),
+    ("today|week", None),
+    ("yesterday", None),
+    (True, None),
+])
+def test_parse_date(value, expected):
+    assert shard.parse_date(value, NOW) == expected
+
+
+def test_find_time_range():
+    query = {"where": {"and": [
+        {"eq": {"repo": "mozilla-central"}},
+        {"gte": ["push.date", {"date": "today-week"}]},
+        {"lt": {"push.date": {"date": "today"}}},
+    ]}}
+    time_range = shard.find_time_range(query, NOW)
+    assert time_range.field == "push.date"
+    assert time_range.lower.timestamp == TODAY - 7 * DAY
+    assert time_range.upper.timestamp == TODAY
+    assert time_range.rest == [{"eq": {"repo": "mozilla-central"}}]
+
+    # Plain strings are compared as strings.
+    assert shard.find_time_range({"where": {"gte": {"push.date": "today"}}}, NOW) is None
+    # Ambiguous lower bounds.
+    query["where"]["and"].append({"gt": {"push.date": 0}})
+    assert shard.find_time_range(query, NOW) is None
+
+
+def test_shard_query():
+    query = {
+        "from": "task",
+        "limit": 100,
+        "where": {"gte": {"run.timestamp": {"date": "today-2day"}}},
+    }
+    shards = shard.shard_query(query, "day", NOW)
+    assert [(s.start, s.end, s.settled) for s in shards] == [
+        (TODAY - 2 * DAY, TODAY - DAY, True),
+        (TODAY - DAY, TODAY, True),
+        (TODAY, None, False),
+    ]
+    assert shards[0].query == {
+        "from": "task",
+        "limit": 100,
+        "where": {"and": [
+            {"gte": {"run.timestamp": TODAY - 2 * DAY}},
+            {"lt": {"run.timestamp": TODAY - DAY}},
+        ]},
+    }
+    assert shards[2].query["where"] == {"and": [{"gte": {"run.timestamp": TODAY}}]}
+
+    # The same shards come up again when the range moves.
+    tomorrow = shard.shard_query(query, "day", NOW + DAY)
+    assert tomorrow[0].query == shards[1].query
+    assert tomorrow[1].query["where"]["and"][0] == shards[2].query["where"]["and"][0]
+
+    # Unaligned bounds are kept as is.
+    query["where"] = {"and": [
+        {"gt": {"run.timestamp": TODAY - DAY - 60}},
+        {"lte": {"run.timestamp": TODAY - 60}},
+    ]}
+    shards = shard.shard_query(query, "day", NOW)
+    assert [s.query["where"]["and"] for s in shards] == [
+        [{"gt": {"run.timestamp": TODAY - DAY - 60}}, {"lt": {"run.timestamp": TODAY - DAY}}],
+        [{"gte": {"run.timestamp": TODAY - DAY}}, {"lte": {"run.timestamp": TODAY - 60}}],
+    ]
+    assert [s.settled for s in shards] == [True, True]
+
+    with pytest.raises(ValueError):
+        shard.shard_query(query, "fortnight", NOW)
+
+
+@pytest.mark.parametrize("extra", [
+    {"groupby": ["result.test"]},
+    {"sort": "run.timestamp"},
+    {"format": "cube"},
+    {"select": {"aggregate": "count"}},
+    {"limit": None},
+])
+def test_shard_query_not_shardable(extra):
+    query = {"from": "task", "limit": 100, "where": {"gte": {"run.timestamp": 0}}}
+    query.update(extra)
+    assert shard.shard_query(query, "day", NOW) is None
+
+
+def test_merge_results():
+    results = [
+        {"header": ["a"], "data": [[1], [2]]},
+        {"header": ["a"], "data": []},
+        {"header": ["a"], "data": [[3], [4]]},
+    ]
+    assert shard.merge_results({"limit": 3}, results) == {"header": ["a"], "data": [[1], [2], [3]]}
+    assert results[0]["data"] == [[1], [2]]
+
+
+def test_shard_boundaries_are_utc():
+    shards = shard.shard_query(
+        {"limit": 10, "where": {"gte": {"date": {"date": "2020-03-09"}}}}, "day", NOW)
+    starts = [datetime.datetime.utcfromtimestamp(s.start) for s in shards]
+    assert starts == [datetime.datetime(2020, 3, 9), datetime.datetime(2020, 3, 10)]
@@ -0,0 +1,54 @@
+import jsone
+import pytest
+from jsone.shared import JSONTemplateError
+
+from adr.template import CompiledTemplate
+
+CONTEXT = {"table": "task", "branches": ["autoland", "mozilla-central"], "limit": 10}
+
+TEMPLATES = [
+    {"from": "meta.columns"},
+    {"from": {"$eval": "table"}, "limit": {"$eval": "limit"}},
+    {"where": {"and": [
+        {"in": {"repo.branch.name": {"$eval": "branches"}}},
+        {"eq": {"build.type": "opt"}},
+    ]}},
+    {"where": {"eq": {"table": {"$eval": "table + '_' + branches[0]"}}}},
+    {"date": {"$eval": "limit * 2"}, "upper": {"$eval": "uppercase(table)"}},
+    {"from": "${table}", "$$escaped": "yes", "${table}": 1},
+    {"select": [{"$if": "limit > 5", "then": "big"}, {"$if": "limit > 50", "then": "huge"}]},
+    {"items": {"$map": {"$eval": "branches"}, "each(b)": {"name": {"$eval": "b"}}}},
+    [1, None, True, 2.5, "all"],
+]
+
+
+@pytest.mark.parametrize("template", TEMPLATES, ids=str)
+def test_compiled_template(template):
+    assert CompiledTemplate(template).render(CONTEXT) == jsone.render(template, CONTEXT)
+
+
+def test_compiled_template_shares_static_values():
+    template = {"from": {"$eval": "table"}, "where": {"eq": {"build.type": "opt"}}}
+    compiled = CompiledTemplate(template)
+
+    first = compiled.render({"table": "task"})
+    second = compiled.render({"table": "unittest"})
+    assert first == {"from": "task", "where": {"eq": {"build.type": "opt"}}}
+    assert second["from"] == "unittest"
+    assert first["where"] is second["where"] is template["where"]
+
+
+@pytest.mark.parametrize("template, context", [
+    ({"from": {"$eval": "missing"}}, {}),
+    ({"from": {"$eval": "table +"}}, CONTEXT),
+    ({"from": {"$eval": "table", "extra": 1}}, CONTEXT),
+    ({"from": "task"}, {"not-valid": 1}),
+])
+def test_compiled_template_errors(template, context):
+    with pytest.raises(JSONTemplateError) as expected:
+        jsone.render(template, context)
+
+    compiled = CompiledTemplate(template)
+    with pytest.raises(JSONTemplateError) as actual:
+        compiled.render(context)
+    assert str(actual.value) == str(expected.value)